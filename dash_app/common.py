@@ -1,19 +1,47 @@
 import json
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Any, Callable, Dict, Optional
 
+import dash
+import dash_bootstrap_components as dbc
+import dash_core_components as dcc
+import dash_html_components as html
+
+from dash_app.job_queue import CANCELLED, DONE, FAILED, JobContext, JobQueue
 from dash_app.updownload_app import APP_DATA_DIR, SUBTITLES_DIR
 from speech_to_text.create_subtitle_files import TranslatedTranscript
+from speech_to_text.letters_file import LETTERS_SUFFIX
 
 LANGUAGE_TO_MODELNAME = {
     "spanish": "jonatasgrosman/wav2vec2-large-xlsr-53-spanish",
     "english": "jonatasgrosman/wav2vec2-large-xlsr-53-english",
 }
 
+# kind -> job-function, filled by the modules defining them
+JOB_FUNCTIONS: Dict[str, Callable[[dict, JobContext], Any]] = {}
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    transcription and burning run here instead of blocking the callbacks
+    queue is started on first use, not on import: processes spawned by the alignment-planner
+    import the dash-modules, too, and must not run jobs
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(f"{SUBTITLES_DIR}/jobs.sqlite").init()
+            for kind, fun in JOB_FUNCTIONS.items():
+                _job_queue.register(kind, fun)
+        return _job_queue
 
-def get_letters_csv(video_file, model_name):
+
+def get_letters_file(video_file, model_name):
     file = Path(f"{APP_DATA_DIR}/{video_file}")
-    return f"{SUBTITLES_DIR}/{file.stem}_{raw_transcript_name(model_name)}_letters.csv"
+    return f"{SUBTITLES_DIR}/{file.stem}_{raw_transcript_name(model_name)}_letters{LETTERS_SUFFIX}"
 
 
 def raw_transcript_name(asr_model_name):
@@ -32,4 +60,55 @@ def get_store_data(store_s) -> Dict[str, TranslatedTranscript]:
 
 
 def build_json_name(video_file,model_name):
-    return f"{SUBTITLES_DIR}/{Path(video_file).stem}_{raw_transcript_name(model_name)}.json"
\ No newline at end of file
+    return f"{SUBTITLES_DIR}/{Path(video_file).stem}_{raw_transcript_name(model_name)}.json"
+
+
+def job_components(name: str) -> html.Div:
+    """
+    holds id of job, polls its status and shows its progress, see poll_job
+    """
+    return html.Div(
+        [
+            dcc.Store(id=f"{name}-job"),
+            dcc.Interval(id=f"{name}-interval", interval=1000, disabled=True),
+            html.Div(id=f"{name}-progress"),
+            dbc.Button(
+                "cancel", id=f"cancel-{name}-button", n_clicks=0, color="secondary"
+            ),
+        ]
+    )
+
+
+def poll_job(job_id: str, on_done: Callable[[Any], Any]):
+    """
+    returns output, job_id to store, whether interval is disabled and progress-view
+    job_id is forgotten once the job finished
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return dash.no_update, None, True, ""
+    elif job.status == DONE:
+        return on_done(job.result), None, True, ""
+    elif job.status == FAILED:
+        print(f"job {job_id} failed: {job.error}")
+        return dash.no_update, None, True, dbc.Alert(
+            f"{job.kind} failed: {job.error.splitlines()[-1]}", color="danger"
+        )
+    elif job.status == CANCELLED:
+        return dash.no_update, None, True, dbc.Alert(
+            f"{job.kind} cancelled", color="warning"
+        )
+    else:
+        return dash.no_update, job_id, False, dbc.Progress(
+            f"{job.message}",
+            value=round(100 * job.progress),
+            striped=True,
+            animated=True,
+        )
+
+
+def triggered_by(component_id: str) -> bool:
+    return any(
+        t["prop_id"].startswith(f"{component_id}.")
+        for t in dash.callback_context.triggered
+    )
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import traceback
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import time
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+IN_FLIGHT = (QUEUED, RUNNING)
+
+POLL_INTERVAL = 1.0  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_key_status ON jobs (key, status);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: dict
+    status: str
+    progress: float  # between 0 and 1
+    message: str
+    result: Any
+    error: Optional[str]
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in IN_FLIGHT
+
+
+def job_key(kind: str, params: dict) -> str:
+    return hashlib.sha1(
+        json.dumps([kind, params], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+@dataclass
+class JobContext:
+    """
+    handed to running job-functions to report progress and to learn about cancellation
+    """
+
+    queue: "JobQueue"
+    job_id: str
+
+    def progress(self, progress: float, message: str = ""):
+        """
+        raises JobCancelled if job was cancelled, so job-functions should call it regularly
+        """
+        with self.queue.connection() as db:
+            db.execute(
+                "UPDATE jobs SET progress=?, message=?, updated=? WHERE id=?",
+                (min(max(progress, 0.0), 1.0), message, time(), self.job_id),
+            )
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled(self.job_id)
+
+    def is_cancelled(self) -> bool:
+        with self.queue.connection() as db:
+            (cancel_requested,) = db.execute(
+                "SELECT cancel_requested FROM jobs WHERE id=?", (self.job_id,)
+            ).fetchone()
+        return cancel_requested == 1
+
+
+@dataclass
+class JobQueue:
+    """
+    jobs are persisted in a sqlite-file, so that they survive page-reloads and can be shared by server-processes
+    submitting a job with same kind and parameters as a queued or running one returns the id of that one
+    num_workers threads run the job-functions registered per kind,
+    each process only claims jobs of kinds it has registered
+    jobs of a dead process that were running are queued again on init
+    """
+
+    db_file: str
+    num_workers: int = 2
+
+    def init(self):
+        self.functions: Dict[str, Callable[[dict, JobContext], Any]] = {}
+        self.wakeup = threading.Event()
+        db = sqlite3.connect(self.db_file, timeout=30)
+        db.executescript(SCHEMA)
+        db.close()
+        with self.connection() as db:
+            running = db.execute(
+                "SELECT id, pid FROM jobs WHERE status=?", (RUNNING,)
+            ).fetchall()
+            orphans = [
+                (QUEUED, job_id) for job_id, pid in running if not _is_alive(pid)
+            ]
+            db.executemany("UPDATE jobs SET status=?, pid=NULL WHERE id=?", orphans)
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.num_workers)
+        ]
+        for w in self.workers:
+            w.start()
+        return self
+
+    @contextmanager
+    def connection(self):
+        """
+        a connection per call, sqlite-connections must not be shared between threads
+        """
+        db = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def register(self, kind: str, fun: Callable[[dict, JobContext], Any]):
+        """
+        fun gets params and a JobContext, returns something json-serializable
+        """
+        self.functions[kind] = fun
+        self.wakeup.set()
+
+    def submit(self, kind: str, params: dict) -> str:
+        key = job_key(kind, params)
+        with self.connection() as db:
+            in_flight = db.execute(
+                "SELECT id FROM jobs WHERE key=? AND status IN (?, ?) AND cancel_requested=0",
+                (key, *IN_FLIGHT),
+            ).fetchone()
+            if in_flight is not None:
+                return in_flight[0]
+            job_id = uuid.uuid4().hex
+            now = time()
+            db.execute(
+                "INSERT INTO jobs (id, kind, key, params, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, key, json.dumps(params), QUEUED, now, now),
+            )
+        self.wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT id, kind, params, status, progress, message, result, error FROM jobs WHERE id=?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, params, status, progress, message, result, error = row
+        return Job(
+            job_id,
+            kind,
+            json.loads(params),
+            status,
+            progress,
+            message,
+            json.loads(result) if result is not None else None,
+            error,
+        )
+
+    def cancel(self, job_id: str):
+        """
+        queued jobs are cancelled right away, running ones once they report progress next time
+        """
+        with self.connection() as db:
+            db.execute(
+                "UPDATE jobs SET cancel_requested=1, updated=? WHERE id=?",
+                (time(), job_id),
+            )
+            db.execute(
+                "UPDATE jobs SET status=? WHERE id=? AND status=?",
+                (CANCELLED, job_id, QUEUED),
+            )
+
+    def _claim(self) -> Optional[str]:
+        kinds = list(self.functions.keys())
+        if len(kinds) == 0:
+            return None
+        with self.connection() as db:
+            row = db.execute(
+                f"SELECT id FROM jobs WHERE status=? AND kind IN ({','.join('?' * len(kinds))}) ORDER BY created LIMIT 1",
+                (QUEUED, *kinds),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status=?, pid=?, updated=? WHERE id=?",
+                (RUNNING, os.getpid(), time(), row[0]),
+            )
+        return row[0]
+
+    def _finish(self, job_id: str, status: str, result=None, error=None):
+        with self.connection() as db:
+            db.execute(
+                "UPDATE jobs SET status=?, result=?, error=?, updated=? WHERE id=?",
+                (
+                    status,
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    time(),
+                    job_id,
+                ),
+            )
+
+    def _work(self):
+        while True:
+            job_id = self._claim()
+            if job_id is None:
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            job = self.get(job_id)
+            context = JobContext(self, job_id)
+            try:
+                context.check_cancelled()
+                result = self.functions[job.kind](job.params, context)
+                self._finish(job_id, DONE, result=result)
+            except JobCancelled:
+                self._finish(job_id, CANCELLED)
+            except Exception:
+                self._finish(job_id, FAILED, error=traceback.format_exc())
+
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        with self.connection() as db:
+            if status is None:
+                rows = db.execute("SELECT id FROM jobs ORDER BY created").fetchall()
+            else:
+                rows = db.execute(
+                    "SELECT id FROM jobs WHERE status=? ORDER BY created", (status,)
+                ).fetchall()
+        return [self.get(job_id) for (job_id,) in rows]
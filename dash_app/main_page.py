@@ -12,7 +12,7 @@ from util import data_io
 from dash_app.app import app
 from dash_app.common import LANGUAGE_TO_MODELNAME, build_json_name
 from dash_app.subtitle_video_creation import burn_video_div
-from dash_app.transcript_text_areas import transcribe_button
+from dash_app.transcript_text_areas import transcribe_button, transcribe_job
 from dash_app.updownload_app import (
     save_file,
     uploaded_files,
@@ -64,7 +64,7 @@ page_content = [
             dbc.Col(
                 html.Div(id="video-player"),
             ),
-            dbc.Col(dbc.Spinner(html.Div(id="video-player-subs"))),
+            dbc.Col(html.Div(id="video-player-subs")),  # progress is shown by burn-job
         ]
     ),
     dbc.Row(
@@ -83,7 +83,7 @@ page_content = [
                 ]
             ),
             dbc.Col(
-                transcribe_button,
+                [transcribe_button, transcribe_job],
                 style={"width": "100%", "padding-top": 40},
             ),
             dbc.Col(
@@ -92,7 +92,7 @@ page_content = [
             ),
         ]
     ),
-    dbc.Spinner(html.Div(id="raw-transcript", style={"fontSize": 10})),
+    html.Div(id="raw-transcript", style={"fontSize": 10}),
     html.Div(id="dependent_on_raw_transcript"),
 ]
 
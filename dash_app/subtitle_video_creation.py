@@ -1,26 +1,43 @@
 import json
-import subprocess
+import os
+from dataclasses import asdict
 from pathlib import Path
 from pprint import pprint
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 import dash_html_components as html
 
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
 from dash_app.app import app
-from dash_app.common import get_store_data
+from dash_app.common import (
+    JOB_FUNCTIONS,
+    LANGUAGE_TO_MODELNAME,
+    get_job_queue,
+    job_components,
+    poll_job,
+    triggered_by,
+)
+from dash_app.job_queue import JobContext
 from dash_app.updownload_app import APP_DATA_DIR, file_download_link
 from speech_to_text.create_subtitle_files import (
     create_ass_file,
+    create_subtitle_track_files,
     SubtitleBlock,
     StyleConfig,
 )
+from speech_to_text.burn_subtitles_into_video import (
+    burn_subtitles_cached,
+    language_code,
+    mux_subtitles,
+)
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 from urllib.parse import quote as urlquote
 
-burn_video_div = html.Div(id="burn_into_video_form")
+burn_video_div = html.Div(
+    [html.Div(id="burn_into_video_form"), job_components("burn")]
+)
 
 
 @app.callback(
@@ -40,12 +57,22 @@ def update_radio_selection(store_s):
                 ]
             ),
             dbc.Col(
-                dbc.Button(
-                    "burn into video",
-                    id="burn-into-video-button",
-                    n_clicks=0,
-                    color="primary",
-                )
+                [
+                    dcc.RadioItems(
+                        id="subtitle-mode",
+                        options=[
+                            {"label": "subtitle-tracks", "value": "soft"},
+                            {"label": "burned in", "value": "hard"},
+                        ],
+                        value="soft",  # burning re-encodes the whole video
+                    ),
+                    dbc.Button(
+                        "create video",
+                        id="burn-into-video-button",
+                        n_clicks=0,
+                        color="primary",
+                    ),
+                ]
             ),
         ]
     )
@@ -53,20 +80,19 @@ def update_radio_selection(store_s):
     return burn_into_video_form
 
 
-@app.callback(
-    Output("video-player-subs", "children"),
-    Input("burn-into-video-button", "n_clicks"),
-    State("subtitle-store", "data"),
-    State("transcripts-radio-selection", "value"),
-    State("video-file-dropdown", "value"),
-)
-def burn_into_video_button(n_clicks, store_s, selection, video_file_name):
-    if store_s is None or n_clicks == 0:
-        raise PreventUpdate
-
+def burn_job_fun(params: dict, context: JobContext) -> str:
+    """
+    mode: soft muxes one subtitle-track per transcript, hard burns them into the video
+    """
+    store_s, selection, video_file_name, mode = (
+        params["subtitle_blocks"],
+        params["selection"],
+        params["video_file"],
+        params["mode"],
+    )
     video_file = Path(f"{APP_DATA_DIR}/{video_file_name}")
     video_subs_file_name = (
-        f"{Path(video_file_name).stem}_{'_'.join(selection)}_subs.mp4"
+        f"{Path(video_file_name).stem}_{'_'.join(selection)}_{mode}_subs.mp4"
     )
 
     def select(sb: SubtitleBlock, selection):
@@ -77,16 +103,79 @@ def burn_into_video_button(n_clicks, store_s, selection, video_file_name):
         select(SubtitleBlock(**d), selection) for d in json.loads(store_s)
     ]
 
+    styles = {name: StyleConfig(fontsize=10.0) for name in selection}
+    if mode == "soft":
+        spoken_language = {v: k for k, v in LANGUAGE_TO_MODELNAME.items()}.get(
+            params["model_name"], "und"
+        )
+        with TemporaryDirectory() as tmp_dir:
+            mux_subtitles(
+                video_file,
+                create_subtitle_track_files(subtitle_blocks, f"{tmp_dir}/track", styles),
+                f"{APP_DATA_DIR}/{video_subs_file_name}",
+                languages={"spoken": language_code(spoken_language)},
+                progress=lambda p: context.progress(p, "muxing"),
+            )
+        return video_subs_file_name
+
     with NamedTemporaryFile(suffix=".ass") as f:
-        create_ass_file(
-            subtitle_blocks,
+        create_ass_file(subtitle_blocks, f.name, styles=styles)
+        burn_subtitles_cached(
+            video_file,
             f.name,
-            styles={name: StyleConfig(fontsize=10.0) for name in selection},
+            f"{APP_DATA_DIR}/{video_subs_file_name}",
+            styles={name: asdict(s) for name, s in styles.items()},
+            num_workers=os.cpu_count(),
+            progress=lambda p: context.progress(p, "burning"),
         )
-        subprocess.check_output(
-            f"/usr/bin/ffmpeg -y -i '{video_file}' -vf ass={f.name} '{APP_DATA_DIR}/{video_subs_file_name}'",
-            shell=True,
+    return video_subs_file_name
+
+
+JOB_FUNCTIONS["burn"] = burn_job_fun
+
+
+@app.callback(
+    Output("video-player-subs", "children"),
+    Output("burn-job", "data"),
+    Output("burn-interval", "disabled"),
+    Output("burn-progress", "children"),
+    Input("burn-into-video-button", "n_clicks"),
+    Input("burn-interval", "n_intervals"),
+    Input("cancel-burn-button", "n_clicks"),
+    State("burn-job", "data"),
+    State("subtitle-store", "data"),
+    State("transcripts-radio-selection", "value"),
+    State("video-file-dropdown", "value"),
+    State("subtitle-mode", "value"),
+    State("asr-model-dropdown", "value"),
+)
+def burn_into_video_button(
+    n_clicks, _, __, job_id, store_s, selection, video_file_name, mode, model_name
+):
+    """
+    burning or muxing runs as job, which is polled until it is done
+    """
+    if triggered_by("burn-into-video-button"):
+        if store_s is None or n_clicks == 0 or not selection:
+            raise PreventUpdate
+        job_id = get_job_queue().submit(
+            "burn",
+            {
+                "subtitle_blocks": store_s,
+                "selection": selection,
+                "video_file": video_file_name,
+                "mode": mode,
+                "model_name": model_name,
+            },
         )
+    elif triggered_by("cancel-burn-button") and job_id is not None:
+        get_job_queue().cancel(job_id)
+    elif job_id is None:
+        raise PreventUpdate
+    return poll_job(job_id, on_done=video_view)
+
+
+def video_view(video_subs_file_name: str):
     return [
         html.H5(f"{video_subs_file_name}"),
         html.Video(
@@ -10,7 +10,9 @@ from dash.exceptions import PreventUpdate
 from util import data_io
 
 from dash_app.app import app
-from dash_app.common import get_letters_csv, build_json_name
+from dash_app.common import get_letters_file, build_json_name
+from speech_to_text.alignment_cache import AlignmentCache
+from speech_to_text.alignment_planner import AlignmentPlanner
 from speech_to_text.create_subtitle_files import (
     TranslatedTranscript,
     segment_transcript_to_subtitle_blocks,
@@ -18,6 +20,11 @@ from speech_to_text.create_subtitle_files import (
 )
 from speech_to_text.transcribe_audio import TARGET_SAMPLE_RATE
 
+ALIGNMENT_CACHE = AlignmentCache().init()  # editing a transcript only re-aligns what changed
+ALIGNMENT_PLANNER = AlignmentPlanner(
+    mode="direct", num_workers=4, alignment_cache=ALIGNMENT_CACHE
+)
+
 process_button = dbc.Button(
     "create subtitles",
     id="process-texts-button",
@@ -50,7 +57,9 @@ def dump_to_disk_process_subtitles(n_clicks, video_file, texts, titles, model_na
         )
 
         named_blocks = segment_transcript_to_subtitle_blocks(
-            get_letters_csv(video_file, model_name), list(data.values())
+            get_letters_file(video_file, model_name),
+            list(data.values()),
+            ALIGNMENT_PLANNER,
         )
         subtitles = dbc.Row(
             [
@@ -67,7 +76,7 @@ def dump_to_disk_process_subtitles(n_clicks, video_file, texts, titles, model_na
                                     timedelta(
                                         milliseconds=round(
                                             1000
-                                            * b[titles[0]][0].index
+                                            * b[titles[0]][0].r_idx
                                             / TARGET_SAMPLE_RATE
                                         )
                                     )
@@ -9,12 +9,24 @@ from dash.exceptions import PreventUpdate
 from util import data_io
 
 from dash_app.app import app
-from dash_app.common import get_letters_csv, raw_transcript_name, get_store_data
+from dash_app.common import (
+    JOB_FUNCTIONS,
+    get_job_queue,
+    get_letters_file,
+    get_store_data,
+    job_components,
+    poll_job,
+    raw_transcript_name,
+    triggered_by,
+)
+from dash_app.job_queue import JobContext
 from dash_app.subtitles_table import process_button
 from dash_app.updownload_app import APP_DATA_DIR, SUBTITLES_DIR
 from speech_to_text.create_subtitle_files import TranslatedTranscript
-from speech_to_text.subtitle_creation import convert_to_wav_transcribe
-from speech_to_text.transcribe_audio import SpeechToText
+from speech_to_text.letters_file import write_letters_file
+from speech_to_text.model_pool import MODEL_POOL
+from speech_to_text.asr_segment_glueing import transcribe_audio_file
+from speech_to_text.audio_reader import media_duration
 
 NO_NAME = "enter some name here"
 
@@ -24,6 +36,7 @@ transcribe_button = dbc.Button(
     n_clicks=0,
     color="primary",
 )
+transcribe_job = job_components("transcribe")
 
 new_text_area_form = dbc.Form(
     [
@@ -40,47 +53,83 @@ new_text_area_form = dbc.Form(
 )
 
 
-def create_or_load_raw_transcript(video_file, model_name) -> str:
+def get_raw_transcript_file(video_file, model_name) -> str:
     file = Path(f"{APP_DATA_DIR}/{video_file}")
-    raw_transcript_file = (
-        f"{SUBTITLES_DIR}/{file.stem}_{raw_transcript_name(model_name)}.txt"
-    )
+    return f"{SUBTITLES_DIR}/{file.stem}_{raw_transcript_name(model_name)}.txt"
+
+
+def create_or_load_raw_transcript(video_file, model_name, progress=None) -> str:
+    """
+    progress: see transcribe_audio_file
+    """
+    file = Path(f"{APP_DATA_DIR}/{video_file}")
+    raw_transcript_file = get_raw_transcript_file(video_file, model_name)
     if not os.path.isfile(raw_transcript_file):
-        asr = SpeechToText(
-            model_name=model_name,
-        ).init()
-        transcript = convert_to_wav_transcribe(asr, str(file))
-        data_io.write_lines(
-            get_letters_csv(video_file, model_name),
-            [f"{l.letter}\t{l.index}" for l in transcript.letters],
+        asr = MODEL_POOL.get(model_name)
+        transcript = transcribe_audio_file(asr, str(file), progress=progress)
+        write_letters_file(
+            get_letters_file(video_file, model_name), transcript, asr.meta
         )
 
-        raw_transcript = "".join([l.letter for l in transcript.letters])
+        raw_transcript = transcript.text
         data_io.write_lines(
             raw_transcript_file,
             [raw_transcript],
         )
+        data_io.write_json(raw_transcript_file.replace(".txt", "_meta.json"), asr.meta)
     else:
         raw_transcript = list(data_io.read_lines(raw_transcript_file))[0]
     return raw_transcript
 
 
+def transcribe_job_fun(params: dict, context: JobContext) -> str:
+    video_file, model_name = params["video_file"], params["model_name"]
+    duration = media_duration(f"{APP_DATA_DIR}/{video_file}")
+    return create_or_load_raw_transcript(
+        video_file,
+        model_name,
+        progress=lambda seconds: context.progress(
+            seconds / duration, f"{seconds:.0f} of {duration:.0f} seconds"
+        ),
+    )
+
+
+JOB_FUNCTIONS["transcribe"] = transcribe_job_fun
+
+
 @app.callback(
     Output("raw-transcript", "children"),
+    Output("transcribe-job", "data"),
+    Output("transcribe-interval", "disabled"),
+    Output("transcribe-progress", "children"),
     Input("create-raw-transcripts-button", "n_clicks"),
+    Input("transcribe-interval", "n_intervals"),
+    Input("cancel-transcribe-button", "n_clicks"),
+    State("transcribe-job", "data"),
     State("video-file-dropdown", "value"),
     State("asr-model-dropdown", "value"),
 )
-def calc_raw_transcript(
-    n_clicks, video_file, asr_model
-):
-
-    if n_clicks > 0:
-        raw_transcript = create_or_load_raw_transcript(video_file, asr_model)
-    else:
+def calc_raw_transcript(n_clicks, _, __, job_id, video_file, asr_model):
+    """
+    transcription runs as job, which is polled until it is done
+    users transcribing same video with same model share one job
+    """
+    if triggered_by("create-raw-transcripts-button") and n_clicks > 0:
+        if video_file is None:
+            raise PreventUpdate
+        raw_transcript_file = get_raw_transcript_file(video_file, asr_model)
+        if os.path.isfile(raw_transcript_file):
+            raw_transcript = list(data_io.read_lines(raw_transcript_file))[0]
+            return raw_transcript, None, True, ""
+        job_id = get_job_queue().submit(
+            "transcribe", {"video_file": video_file, "model_name": asr_model}
+        )
+    elif triggered_by("cancel-transcribe-button") and job_id is not None:
+        get_job_queue().cancel(job_id)
+    elif job_id is None:
         print(f"DEBUG: not updating raw_transcript")
         raise PreventUpdate
-    return raw_transcript
+    return poll_job(job_id, on_done=lambda raw_transcript: raw_transcript)
     # html.H2("raw transcript"),
     # dbc.Row(, style={"padding-top": 20}),
 
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+
+import grpc
+import numpy as np
+
+sys.path.append(".")
+sys.path.append(f"{os.path.dirname(os.path.abspath(__file__))}/grpc_api")
+
+import s2t_pb2
+import s2t_pb2_grpc
+
+from speech_to_text.batch_scheduler import InferenceScheduler
+from speech_to_text.model_pool import MODEL_POOL
+from speech_to_text.streaming_transcriber import StreamingTranscriber
+
+
+async def pcm_chunks(request_iterator):
+    """
+    16kHz int16 PCM, a sample might be split over two requests
+    """
+    rest = b""
+    async for request in request_iterator:
+        data = rest + request.audio_chunk
+        num_bytes = len(data) // 2 * 2
+        rest = data[num_bytes:]
+        yield np.frombuffer(data[:num_bytes], dtype=np.int16)
+
+
+class Speech2TextServicer(s2t_pb2_grpc.Speech2TextServicer):
+    def __init__(
+        self,
+        scheduler: InferenceScheduler,
+        window_dur: float,
+        hop_dur: float,
+        glue: str = "text",
+    ):
+        self.scheduler = scheduler
+        self.window_dur = window_dur
+        self.hop_dur = hop_dur
+        self.glue = glue
+
+    async def transcribe_stream(self, request_iterator, context):
+        transcriber = StreamingTranscriber(
+            self.window_dur,
+            self.hop_dur,
+            glue=self.glue,
+            decoder=self.scheduler.asr.decoder,
+        ).init()
+        async for chunk in pcm_chunks(request_iterator):
+            for start_idx, window in transcriber.push_audio(chunk):
+                for response in await self._transcribe_window(
+                    transcriber, start_idx, window
+                ):
+                    yield response
+
+        for start_idx, window in transcriber.flush_audio():
+            for response in await self._transcribe_window(
+                transcriber, start_idx, window
+            ):
+                yield response
+        final = transcriber.finish()
+        if len(final) > 0:
+            yield s2t_pb2.TranscribeStreamResponse(transcription=final, is_final=True)
+
+    async def _transcribe_window(
+        self, transcriber: StreamingTranscriber, start_idx, window
+    ):
+        letters, frame_path = await self.scheduler.transcribe(window)
+        final, interim = transcriber.add_transcript(start_idx, letters, frame_path)
+        responses = []
+        if len(final) > 0:
+            responses.append(
+                s2t_pb2.TranscribeStreamResponse(transcription=final, is_final=True)
+            )
+        responses.append(
+            s2t_pb2.TranscribeStreamResponse(transcription=interim, is_final=False)
+        )
+        return responses
+
+
+async def log_metrics(scheduler: InferenceScheduler, interval: float = 60.0):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"scheduler-metrics: {scheduler.metrics}")
+
+
+async def serve(
+    model_name: str,
+    port: int,
+    window_dur: float,
+    hop_dur: float,
+    max_batch_size: int,
+    max_wait: float,
+    glue: str,
+):
+    scheduler = InferenceScheduler(
+        MODEL_POOL.get(model_name), max_batch_size, max_wait
+    ).init()
+    scheduler.start()
+    metrics_task = asyncio.create_task(log_metrics(scheduler))
+
+    server = grpc.aio.server()
+    s2t_pb2_grpc.add_Speech2TextServicer_to_server(
+        Speech2TextServicer(scheduler, window_dur, hop_dur, glue), server
+    )
+    server.add_insecure_port(f"[::]:{port}")
+    await server.start()
+    print(f"serving {model_name} on port {port}")
+    try:
+        await server.wait_for_termination()
+    finally:
+        metrics_task.cancel()
+        await scheduler.stop()
+
+
+if __name__ == "__main__":
+    """
+    python grpc_streaming/server.py facebook/wav2vec2-base-960h 50051 10.0 5.0 8 0.05 frames
+    """
+    model_name = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 50051
+    window_dur = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    hop_dur = float(sys.argv[4]) if len(sys.argv) > 4 else 5.0
+    max_batch_size = int(sys.argv[5]) if len(sys.argv) > 5 else 8
+    max_wait = float(sys.argv[6]) if len(sys.argv) > 6 else 0.05
+    glue = sys.argv[7] if len(sys.argv) > 7 else "text"
+    asyncio.run(
+        serve(model_name, port, window_dur, hop_dur, max_batch_size, max_wait, glue)
+    )
@@ -0,0 +1,180 @@
+import difflib
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from speech_to_text.create_subtitle_files import (
+    FORCE_BREAK,
+    temporal_align_text_to_letters,
+)
+from speech_to_text.transcribe_audio import LetterArray
+
+SEPARATOR = f" {FORCE_BREAK} "  # what temporal_align_text_to_letters makes out of line-breaks
+
+
+def letters_hash(letters: LetterArray) -> str:
+    h = hashlib.sha1(np.ascontiguousarray(letters.codepoints).tobytes())
+    h.update(np.ascontiguousarray(letters.r_idx).tobytes())
+    return h.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class AlignedParagraphs:
+    paragraphs: List[str]
+    pieces: List[LetterArray]  # aligned paragraph followed by aligned separator, if not last
+
+
+@dataclass
+class AlignmentCache:
+    """
+    results of temporal_align_text_to_letters per (reference-letters, text)
+    for an edited version of a transcript only the changed paragraphs are aligned again,
+    on the part of the reference that lies between the unchanged paragraphs around them
+    thread-safe, aligning is done outside of the lock
+    """
+
+    max_entries: int = 100
+
+    def init(self):
+        # both LRU, keyed by (reference, text) and (reference, transcript-name)
+        self.results: "OrderedDict[Tuple[str, str], LetterArray]" = OrderedDict()
+        self.latest: "OrderedDict[Tuple[str, str], AlignedParagraphs]" = OrderedDict()
+        self._lock = threading.Lock()
+        return self
+
+    def align(self, name: str, text: str, reference: LetterArray) -> LetterArray:
+        aligned = self.get(text, reference)
+        if aligned is None:
+            aligned_paragraphs = align_paragraphs(
+                text, reference, self.previous(name, reference)
+            )
+            aligned = self.put(name, text, reference, aligned_paragraphs)
+        return aligned
+
+    def get(self, text: str, reference: LetterArray) -> Optional[LetterArray]:
+        key = (letters_hash(reference), text_hash(text))
+        with self._lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+            else:
+                return None
+
+    def previous(self, name: str, reference: LetterArray) -> Optional[AlignedParagraphs]:
+        """
+        latest alignment of transcript name onto reference, to be passed to align_paragraphs
+        """
+        key = (letters_hash(reference), name)
+        with self._lock:
+            return self.latest.get(key)
+
+    def put(
+        self,
+        name: str,
+        text: str,
+        reference: LetterArray,
+        aligned_paragraphs: AlignedParagraphs,
+    ) -> LetterArray:
+        reference_key = letters_hash(reference)
+        aligned = LetterArray.concat(aligned_paragraphs.pieces)
+        results_key = (reference_key, text_hash(text))
+        with self._lock:
+            self._store(self.latest, (reference_key, name), aligned_paragraphs)
+            self._store(self.results, results_key, aligned)
+        return aligned
+
+    def _store(self, lru: OrderedDict, key, value):
+        lru[key] = value
+        lru.move_to_end(key)
+        if len(lru) > self.max_entries:
+            lru.popitem(last=False)
+
+
+def align_paragraphs(
+    text: str, reference: LetterArray, previous: Optional[AlignedParagraphs] = None
+) -> AlignedParagraphs:
+    """
+    if previous alignment of an older version of text is given, only changed paragraphs are aligned
+    """
+    paragraphs = re.split(r"\n+", text)
+    if previous is None:
+        aligned = temporal_align_text_to_letters(text, reference)
+        pieces = split_into_pieces(aligned, paragraphs)
+    else:
+        pieces = realign_changed(previous, paragraphs, reference)
+    return AlignedParagraphs(paragraphs, pieces)
+
+
+def split_into_pieces(
+    aligned: LetterArray, paragraphs: List[str]
+) -> List[LetterArray]:
+    lengths = [len(p) + len(SEPARATOR) for p in paragraphs[:-1]]
+    lengths.append(len(paragraphs[-1]))
+    ends = np.cumsum(lengths)
+    assert ends[-1] == len(aligned)
+    return [aligned[end - n : end] for n, end in zip(lengths, ends)]
+
+
+def with_separator(piece: LetterArray, paragraph: str, needed: bool) -> LetterArray:
+    has_separator = len(piece) > len(paragraph)
+    if has_separator and not needed:
+        return piece[: len(paragraph)]
+    elif needed and not has_separator:
+        idx = piece.r_idx[-1] if len(piece) > 0 else 0
+        separator = LetterArray.from_text(SEPARATOR, [idx] * len(SEPARATOR))
+        return LetterArray.concat([piece, separator])
+    else:
+        return piece
+
+
+def realign_changed(
+    previous: AlignedParagraphs, paragraphs: List[str], reference: LetterArray
+) -> List[LetterArray]:
+    opcodes = difflib.SequenceMatcher(
+        None, previous.paragraphs, paragraphs, autojunk=False
+    ).get_opcodes()
+    pieces: List[LetterArray] = []
+    for k, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == "equal":
+            pieces.extend(previous.pieces[i1:i2])
+        elif tag in ["replace", "insert"]:
+            done = [p for p in pieces if len(p) > 0]
+            start = done[-1].r_idx[-1] if len(done) > 0 else reference.r_idx[0]
+            following = [
+                p
+                for tag_, i1_, i2_, _, _ in opcodes[k + 1 :]
+                if tag_ == "equal"
+                for p in previous.pieces[i1_:i2_]
+                if len(p) > 0
+            ]
+            end = following[0].r_idx[0] if len(following) > 0 else reference.r_idx[-1]
+            region = reference.slice_by_samples(start, end + 1)
+            pieces.extend(align_region(paragraphs[j1:j2], region, start))
+
+    return [
+        with_separator(piece, paragraph, k < len(paragraphs) - 1)
+        for k, (piece, paragraph) in enumerate(zip(pieces, paragraphs))
+    ]
+
+
+def align_region(
+    paragraphs: List[str], reference: LetterArray, start: int
+) -> List[LetterArray]:
+    text = "\n".join(paragraphs)
+    if len(reference) == 0:  # nothing to align to, squeeze it in after preceding text
+        text = re.sub(r"\n+", SEPARATOR, text)
+        aligned = LetterArray.from_text(
+            text, np.full(len(text), start, dtype=np.int64)
+        )
+    else:
+        aligned = temporal_align_text_to_letters(text, reference)
+    return split_into_pieces(aligned, paragraphs)
@@ -0,0 +1,167 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from speech_to_text.alignment_cache import (
+    AlignedParagraphs,
+    AlignmentCache,
+    align_paragraphs,
+)
+from speech_to_text.create_subtitle_files import TranslatedTranscript
+from speech_to_text.transcribe_audio import LetterArray
+
+ALIGNMENT_MODES = ["direct", "chained"]
+
+
+@dataclass
+class AlignmentTask:
+    transcript: TranslatedTranscript
+    pivot: Optional[str]  # name of transcript to align onto, None for spoken letters
+
+
+def _timed_align_paragraphs(
+    text: str, reference: LetterArray, previous: Optional[AlignedParagraphs]
+) -> Tuple[AlignedParagraphs, float]:
+    start = time()
+    aligned = align_paragraphs(text, reference, previous)
+    return aligned, time() - start
+
+
+@dataclass
+class AlignmentPlanner:
+    """
+    direct: each transcript is aligned onto the spoken letters, all independent of each other
+    chained: each transcript is aligned onto its pivot, which is the transcript before it (by order)
+        unless TranslatedTranscript.pivot names another one, heuristic is to use language-similarities:
+        native->spanish->english->german
+    transcripts whose pivots are aligned already are aligned concurrently in num_workers processes,
+    which are spawned (not forked, the caller might be multi-threaded) once and reused across calls
+    durations holds alignment-time per transcript-name of last call to align, 0 for cache-hits
+    """
+
+    mode: str = "direct"
+    num_workers: int = 1
+    alignment_cache: Optional[AlignmentCache] = None
+
+    def __post_init__(self):
+        assert self.mode in ALIGNMENT_MODES, f"unknown mode {self.mode}"
+        self.durations: Dict[str, float] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.num_workers <= 1:
+            return None
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.num_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def plan(
+        self, transcripts: List[TranslatedTranscript]
+    ) -> List[List[AlignmentTask]]:
+        """
+        stages of tasks, tasks of a stage only depend on earlier stages
+        """
+        transcripts = sorted(transcripts, key=lambda x: x.order)
+        names = [tt.name for tt in transcripts]
+        pivots = {}
+        for k, tt in enumerate(transcripts):
+            if self.mode == "direct":
+                pivots[tt.name] = None
+            elif tt.pivot is not None:
+                assert tt.pivot in names, f"unknown pivot {tt.pivot} of {tt.name}"
+                pivots[tt.name] = tt.pivot
+            else:
+                pivots[tt.name] = names[k - 1] if k > 0 else None
+
+        depths: Dict[str, int] = {}
+
+        def depth(name: str, visited=()) -> int:
+            assert name not in visited, f"cyclic pivots: {visited}"
+            if name not in depths:
+                pivot = pivots[name]
+                depths[name] = 0 if pivot is None else depth(pivot, visited + (name,)) + 1
+            return depths[name]
+
+        stages: List[List[AlignmentTask]] = [[] for _ in range(len(transcripts))]
+        for tt in transcripts:
+            stages[depth(tt.name)].append(AlignmentTask(tt, pivots[tt.name]))
+        return [s for s in stages if len(s) > 0]
+
+    def align(
+        self, raw_letters: LetterArray, transcripts: List[TranslatedTranscript]
+    ) -> List[Tuple[str, LetterArray]]:
+        """
+        returns aligned letters per transcript-name, sorted by order
+        """
+        self.durations = {}
+        aligned: Dict[str, LetterArray] = {}
+        for stage in self.plan(transcripts):
+            self._align_stage(stage, raw_letters, aligned, self.executor())
+
+        for name, duration in self.durations.items():
+            print(f"aligned {name} in {duration:.2f} seconds")
+        return [
+            (tt.name, aligned[tt.name])
+            for tt in sorted(transcripts, key=lambda x: x.order)
+        ]
+
+    def _align_stage(
+        self,
+        stage: List[AlignmentTask],
+        raw_letters: LetterArray,
+        aligned: Dict[str, LetterArray],
+        executor: Optional[ProcessPoolExecutor],
+    ):
+        todo = []
+        for task in stage:
+            tt = task.transcript
+            reference = raw_letters if task.pivot is None else aligned[task.pivot]
+            hit = (
+                self.alignment_cache.get(tt.text, reference)
+                if self.alignment_cache is not None
+                else None
+            )
+            if hit is not None:
+                aligned[tt.name] = hit
+                self.durations[tt.name] = 0.0
+            else:
+                previous = (
+                    self.alignment_cache.previous(tt.name, reference)
+                    if self.alignment_cache is not None
+                    else None
+                )
+                todo.append((tt, reference, previous))
+
+        if executor is not None and len(todo) > 1:
+            futures = [
+                executor.submit(_timed_align_paragraphs, tt.text, reference, previous)
+                for tt, reference, previous in todo
+            ]
+            results = [f.result() for f in futures]
+        else:
+            results = [
+                _timed_align_paragraphs(tt.text, reference, previous)
+                for tt, reference, previous in todo
+            ]
+
+        for (tt, reference, _), (aligned_paragraphs, duration) in zip(todo, results):
+            self.durations[tt.name] = duration
+            if self.alignment_cache is not None:
+                aligned[tt.name] = self.alignment_cache.put(
+                    tt.name, tt.text, reference, aligned_paragraphs
+                )
+            else:
+                aligned[tt.name] = LetterArray.concat(aligned_paragraphs.pieces)
@@ -1,68 +1,125 @@
-import os
-import pickle
+import itertools
 import sys
+from tempfile import TemporaryFile
 
 import icdiff
 from util import data_io
 
 sys.path.append(".")
 import difflib
-from typing import Optional, List, Tuple
+from dataclasses import dataclass
+from typing import Callable, Optional, List, Tuple, Iterable, Iterator
 
 import numpy as np
-from nemo.collections.asr.parts.preprocessing import AudioSegment
 
+from speech_to_text.audio_reader import (
+    blocks_to_memmap,
+    generate_windows,
+    read_blocks,
+)
+from speech_to_text.emissions_cache import (
+    EmissionsCache,
+    WindowEmissions,
+    file_emissions_key,
+)
 from speech_to_text.transcribe_audio import (
     SpeechToText,
     AlignedTranscript,
-    LetterIdx,
+    FramePath,
+    GreedyDecoder,
+    LetterArray,
     TARGET_SAMPLE_RATE,
 )
+from speech_to_text.vad import SpeechSpans, detect_speech, generate_vad_arrays
+
+
+GLUE_STRATEGIES = ["text", "frames"]
+
+
+@dataclass
+class TranscriptGluer:
+    """
+    glues overlapping windows' transcripts one after the other
+    letters before the start of the latest window can not change anymore and are committed,
+    only the not yet committed letters of the latest window are kept
+    glue: "text" matches decoded letters, "frames" compares greedy paths and needs decoder and frame_paths
+    """
+
+    debug: bool = False
+    glue: str = "text"
+    decoder: Optional[GreedyDecoder] = None
+
+    def init(self):
+        assert self.glue in GLUE_STRATEGIES
+        assert self.glue == "text" or self.decoder is not None
+        self.sm = difflib.SequenceMatcher()
+        self.previous: Optional[AlignedTranscript] = None
+        self.pending = LetterArray.concat([])  # absolute indizes
+        return self
+
+    def push(
+        self, ts: AlignedTranscript, commit_until: Optional[int] = None
+    ) -> LetterArray:
+        """
+        commit_until: if known, start of next window, defaults to start of ts
+        returns newly committed letters
+        """
+        if self.previous is not None:
+            if (
+                self.glue == "frames"
+                and self.previous.frame_path is not None
+                and ts.frame_path is not None
+            ):
+                glued = glue_left_right_frames(
+                    left=self.previous, right=ts, decoder=self.decoder, debug=self.debug
+                )
+            else:
+                glued = glue_left_right(
+                    left=self.previous, right=ts, sm=self.sm, debug=self.debug
+                )
+            # glued starts with what previous saw in overlap, which is replaced
+            self.pending = LetterArray.concat(
+                [
+                    self.pending.slice_by_samples(end=ts.start_idx),
+                    glued.letters.shift(glued.start_idx),
+                ]
+            )
+        else:
+            if self.debug:
+                print(f"initial: {ts.text}")
+            self.pending = ts.letters.shift(ts.start_idx)
+        self.previous = ts
+
+        commit_until = ts.start_idx if commit_until is None else commit_until
+        committed = self.pending.slice_by_samples(end=commit_until)
+        self.pending = self.pending.slice_by_samples(start=commit_until)
+        return committed
+
+    def finish(self) -> LetterArray:
+        committed = self.pending
+        self.pending = LetterArray.concat([])
+        return committed
 
 
 def glue_transcripts(
-    aligned_transcripts: List[AlignedTranscript],
+    aligned_transcripts: Iterable[AlignedTranscript],
     debug=True,
+    glue="text",
+    decoder: Optional[GreedyDecoder] = None,
 ) -> AlignedTranscript:
-    all_but_last_must_be_of_same_len = (
-        len(set((len(x.letters) for x in aligned_transcripts[:-1]))) == 1
-    ), [len(x.letters) for x in aligned_transcripts]
-    assert all_but_last_must_be_of_same_len
-
-    sm = difflib.SequenceMatcher()
+    gluer = TranscriptGluer(debug, glue, decoder).init()
     sample_rate = None
-    previous: Optional[AlignedTranscript] = None
-    letters: List[LetterIdx] = []
+    letters: List[LetterArray] = []
     for ts in aligned_transcripts:
         if sample_rate is None:
             sample_rate = ts.sample_rate
-        if previous is not None:
-            glued = glue_left_right(left=previous, right=ts, sm=sm, debug=debug)
-            print(f"prev-start_idx: {glued.abs_idx(glued.letters[0])}")
-            letters = [
-                l for l in letters if l.r_idx < glued.abs_idx(glued.letters[0])
-            ]
-            letters.extend(
-                [LetterIdx(l.letter, glued.abs_idx(l)) for l in glued.letters]
-            )
-        else:
-            right = ts
-            if debug:
-                print(f"initial: {right.text}")
             assert ts.start_idx == 0
-            letters.extend(
-                [LetterIdx(x.letter, right.abs_idx(x)) for x in right.letters]
-            )
-        previous = ts
+        letters.append(gluer.push(ts))
+    letters.append(gluer.finish())
 
-    assert all(
-        (letters[k].r_idx > letters[k - 1].r_idx for k in range(1, len(letters)))
-    )
-    assert aligned_transcripts[0].start_idx == 0
-    transcript = AlignedTranscript(
-        letters, sample_rate, start_idx=aligned_transcripts[0].start_idx
-    )
-    return transcript
+    letters = LetterArray.concat(letters)
+    assert np.all(np.diff(letters.r_idx) >= 0)  # characters of a multi-character token share an index
+    return AlignedTranscript(letters, sample_rate)
 
 
 def glue_left_right(
@@ -91,90 +148,267 @@ def glue_left_right(
     assert sr == left.sample_rate
 
     left = AlignedTranscript(
-        letters=[s for s in left.letters if left.abs_idx(s) >= right.start_idx],
+        letters=left.letters.slice_by_samples(start=right.start_idx - left.start_idx),
         sample_rate=sr,
         start_idx=left.start_idx,
     )
 
-    cut_right_just_to_help_alingment = AlignedTranscript(
-        [
-            l
-            for l in right.letters
-            if right.abs_idx(l) < left.abs_idx(left.letters[-1])
-        ],
-        sr,
-        right.start_idx,
-    )
-    sm.set_seqs(left.text, cut_right_just_to_help_alingment.text)
-    matches = [m for m in sm.get_matching_blocks() if m.size > 0]
-    aligned_idx = [(m.a + k, m.b + k) for m in matches for k in range(m.size)]
-    match_idx_closest_to_middle = np.argmin(
-        [np.abs(i - round(len(left.text) / 2)) for i, _ in aligned_idx]
+    if len(left.letters) > 0 and len(right.letters) > 0:
+        cut_right_just_to_help_alingment = AlignedTranscript(
+            right.letters.slice_by_samples(
+                end=left.abs_idx(left.letters[-1]) - right.start_idx
+            ),
+            sr,
+            right.start_idx,
+        )
+        sm.set_seqs(left.text, cut_right_just_to_help_alingment.text)
+        matches = [m for m in sm.get_matching_blocks() if m.size > 0]
+        aligned_idx = [(m.a + k, m.b + k) for m in matches for k in range(m.size)]
+    else:
+        aligned_idx = []
+
+    if len(aligned_idx) > 0:
+        match_idx_closest_to_middle = np.argmin(
+            [np.abs(i - round(len(left.text) / 2)) for i, _ in aligned_idx]
+        )
+        glue_left, glue_right = aligned_idx[match_idx_closest_to_middle]
+        glue_idx_left = int(left.letters.r_idx[glue_left])
+        glue_idx_right = int(right.letters.r_idx[glue_right])
+    else:
+        # nothing to glue on (silence), keep what left saw in overlap and append what right saw after it
+        glue_idx_left = (
+            int(left.letters.r_idx[-1])
+            if len(left.letters) > 0
+            else right.start_idx - left.start_idx - 1
+        )
+        glue_idx_right = glue_idx_left + left.start_idx - right.start_idx
+    letters_right = right.letters.slice_by_samples(start=glue_idx_right + 1).shift(
+        right.start_idx - left.start_idx
     )
-    glue_left, glue_right = aligned_idx[match_idx_closest_to_middle]
-    glue_idx_left = left.letters[glue_left].r_idx
-    glue_idx_right = right.letters[glue_right].r_idx
-    letters_right = [
-        LetterIdx(x.letter, x.r_idx + right.start_idx - left.start_idx)
-        for x in right.letters
-        if x.r_idx > glue_idx_right
-    ]
-    letters_left = [x for x in left.letters if x.r_idx <= glue_idx_left]
+    letters_left = left.letters.slice_by_samples(end=glue_idx_left + 1)
     if debug:
         print(f"left: {left.text}, right: {right.text}")
         print(
             f"GLUED left: {AlignedTranscript(letters_left, sr).text}, right: {AlignedTranscript(letters_right, sr).text}"
         )
-    return AlignedTranscript(letters_left + letters_right, sr, start_idx=left.start_idx)
+    return AlignedTranscript(
+        LetterArray.concat([letters_left, letters_right]), sr, start_idx=left.start_idx
+    )
 
 
-def generate_arrays(samples: np.ndarray, step):
-    for idx in range(0, len(samples), step):
-        segm_end_idx = round(idx + 2 * step)
-        next_segment_too_small = len(samples) - segm_end_idx < step
-        if next_segment_too_small:
-            array = samples[idx:]  # merge this one with next
-            yield idx, array
-            break
-        else:
-            array = samples[idx:segm_end_idx]
-            yield idx, array
+def glue_left_right_frames(
+    left: AlignedTranscript,
+    right: AlignedTranscript,
+    decoder: GreedyDecoder,
+    debug=False,
+) -> AlignedTranscript:
+    """
+    like glue_left_right but the glue-point is a frame in the overlap where neither greedy path emits a letter,
+    preferably inside a pause where both paths agree on silence, closest to the middle of the overlap
+    left letters before and right letters after the glue-point are kept
+    falls back to glue_left_right if windows' letters do not overlap
+    """
+    sr = right.sample_rate
+    assert sr == left.sample_rate
+    left_path, right_path = left.frame_path, right.frame_path
+    offset = right.start_idx - left.start_idx
+    if len(left.letters) == 0 or len(right.letters) == 0:
+        return glue_left_right(left, right, difflib.SequenceMatcher(), debug)
+    # silence at window-edges is stripped by decoder, so glue-point must lie within both windows' letters
+    right_frames = np.arange(len(right_path.path))
+    right_samples = right_path.frame_to_sample(right_frames)
+    right_frames = right_frames[
+        (right_samples > right.letters.r_idx[0])
+        & (right_samples + offset < left.letters.r_idx[-1])
+    ]
+    if len(right_frames) == 0:
+        return glue_left_right(left, right, difflib.SequenceMatcher(), debug)
 
+    samples_per_frame = left_path.input_len / len(left_path.path)
+    left_frames = np.clip(
+        np.rint((right_path.frame_to_sample(right_frames) + offset) / samples_per_frame),
+        0,
+        len(left_path.path) - 1,
+    ).astype(np.int64)
 
-def transcribe_audio_file(asr: SpeechToText, file, step_dur=5, do_cache=False):
-    audio = AudioSegment.from_file(
-        file,
-        target_sr=TARGET_SAMPLE_RATE,
-        offset=0.0,
-        trim=False,
+    def is_emitting(path: np.ndarray) -> np.ndarray:
+        is_new = np.ones(len(path), dtype=bool)
+        is_new[1:] = path[1:] != path[:-1]
+        return is_new & (path != decoder.blank)
+
+    quiet = ~is_emitting(left_path.path)[left_frames] & ~is_emitting(right_path.path)[
+        right_frames
+    ]
+    # neighbours also quiet -> robust against letters being shifted by a frame
+    robust = quiet.copy()
+    robust[1:] &= quiet[:-1]
+    robust[:-1] &= quiet[1:]
+    silence = (left_path.path[left_frames] == decoder.silence_idx) & (
+        right_path.path[right_frames] == decoder.silence_idx
     )
-    step = round(TARGET_SAMPLE_RATE * step_dur)
-    arrays = generate_arrays(audio.samples, step)
+    tier = np.select([robust & silence, robust, quiet], [0, 1, 2], default=3)
+    distance_to_middle = np.abs(np.arange(len(right_frames)) - len(right_frames) // 2)
+    glue_frame = np.argmin(tier * len(right_frames) + distance_to_middle)
 
-    cache_file = "aligned_transcripts.pkl"
-    if not do_cache or not os.path.isfile(cache_file):
+    glue_idx_left = int(left_path.frame_to_sample(left_frames[glue_frame]))
+    glue_idx_right = int(right_path.frame_to_sample(right_frames[glue_frame]))
+    letters_left = left.letters.slice_by_samples(start=offset, end=glue_idx_left)
+    letters_right = right.letters.slice_by_samples(start=glue_idx_right).shift(offset)
+    if debug:
+        print(f"left: {left.text}, right: {right.text}")
+        print(f"GLUED left: {letters_left.text}, right: {letters_right.text}")
+    return AlignedTranscript(
+        LetterArray.concat([letters_left, letters_right]), sr, start_idx=left.start_idx
+    )
 
-        aligned_transcripts = [
-            AlignedTranscript(
-                asr.transcribe_audio_array(array, TARGET_SAMPLE_RATE),
+
+def generate_batches(
+    arrays: Iterable[Tuple[int, np.ndarray]], batch_size: int
+) -> Iterator[List[Tuple[int, np.ndarray]]]:
+    arrays = iter(arrays)
+    while True:
+        batch = list(itertools.islice(arrays, batch_size))
+        if len(batch) == 0:
+            break
+        yield batch
+
+
+def transcribe_arrays(
+    asr: SpeechToText, arrays: Iterable[Tuple[int, np.ndarray]], batch_size=8
+) -> Iterator[AlignedTranscript]:
+    """
+    runs batch_size windows per forward-pass, batch_size=1 is one forward-pass per window
+    """
+    for batch in generate_batches(arrays, batch_size):
+        results = asr.transcribe_audio_arrays_with_frame_paths(
+            [array for _, array in batch], TARGET_SAMPLE_RATE
+        )
+        for (idx, _), (window_letters, frame_path) in zip(batch, results):
+            yield AlignedTranscript(
+                window_letters,
                 sample_rate=TARGET_SAMPLE_RATE,
                 start_idx=idx,
+                frame_path=frame_path,
             )
-            for idx, array in arrays
-        ]
-        with open(cache_file, "wb") as f:
-            pickle.dump(aligned_transcripts, f)
-    else:
-        print(f"found cached {cache_file}")
 
-    if do_cache:
-        with open(cache_file, "rb") as f:
-            aligned_transcripts = pickle.load(f)
 
-    transcript = glue_transcripts(aligned_transcripts)
+def calc_emissions(
+    asr: SpeechToText, arrays: Iterable[Tuple[int, np.ndarray]], batch_size=8
+) -> Iterator[WindowEmissions]:
+    for batch in generate_batches(arrays, batch_size):
+        logits = asr._calc_logits_batch(
+            [array for _, array in batch], TARGET_SAMPLE_RATE
+        )
+        for (idx, array), window_logits in zip(batch, logits):
+            yield WindowEmissions(idx, len(array), window_logits[0].numpy())
+
+
+def decode_emissions(asr: SpeechToText, emissions: WindowEmissions) -> AlignedTranscript:
+    greedy_path = np.argmax(emissions.logits, axis=-1)
+    [letters] = asr.decode_paths_with_timestamps(
+        greedy_path[None], [emissions.input_len]
+    )
+    return AlignedTranscript(
+        letters,
+        sample_rate=TARGET_SAMPLE_RATE,
+        start_idx=emissions.start_idx,
+        frame_path=FramePath(greedy_path, emissions.input_len),
+    )
+
+
+def transcribe_audio_file(
+    asr: SpeechToText,
+    file,
+    step_dur=5,
+    do_cache=False,
+    batch_size=8,
+    cache: Optional[EmissionsCache] = None,
+    vad=False,
+    glue="text",
+    progress: Optional[Callable[[float], None]] = None,
+):
+    """
+    audio is read block by block, only the windows of the current batch are held in memory
+    do_cache: per-window logits are stored in cache, keyed by file-content, model and window-parameters
+    vad: only speech-regions are transcribed, letter-indizes still refer to the original audio,
+        needs random access to the audio, which is buffered in a temporary file
+    glue: see TranscriptGluer
+    progress: called with the position (in seconds of the original audio) of each window before it is transcribed,
+        exceptions raised by it abort the transcription
+    """
+    step = round(TARGET_SAMPLE_RATE * step_dur)
+    key = (
+        file_emissions_key(file, {**asr.meta, "step": step, "vad": vad})
+        if do_cache
+        else None
+    )
+    if vad:
+        with TemporaryFile() as tmp_file:
+            samples = blocks_to_memmap(read_blocks(file), tmp_file)
+            speech_spans = detect_speech(samples, TARGET_SAMPLE_RATE)
+            if speech_spans.num_samples == 0:  # shorter than a vad-frame
+                print(f"WARNING: {file} is too short for vad, got no audio to transcribe")
+                return AlignedTranscript([], TARGET_SAMPLE_RATE)
+            arrays = generate_vad_arrays(samples, speech_spans, step)
+            if progress is not None:
+                arrays = report_progress(arrays, progress, speech_spans)
+            transcript = transcribe_windows(
+                asr, arrays, batch_size, key, cache, glue
+            )
+        original_idx = speech_spans.to_original(transcript.array_idx)
+        transcript = AlignedTranscript(
+            LetterArray(transcript.letters.codepoints, original_idx),
+            TARGET_SAMPLE_RATE,
+        )
+    else:
+        arrays = generate_windows(read_blocks(file), step)
+        if progress is not None:
+            arrays = report_progress(arrays, progress)
+        transcript = transcribe_windows(asr, arrays, batch_size, key, cache, glue)
     return transcript
 
 
+def report_progress(
+    arrays: Iterable[Tuple[int, np.ndarray]],
+    progress: Callable[[float], None],
+    speech_spans: Optional[SpeechSpans] = None,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    speech_spans: if windows are on compact timeline of vad
+    """
+    for idx, array in arrays:
+        original_idx = idx if speech_spans is None else speech_spans.to_original(idx)
+        progress(original_idx / TARGET_SAMPLE_RATE)
+        yield idx, array
+
+
+def transcribe_windows(
+    asr: SpeechToText,
+    arrays: Iterable[Tuple[int, np.ndarray]],
+    batch_size=8,
+    cache_key: Optional[str] = None,
+    cache: Optional[EmissionsCache] = None,
+    glue="text",
+) -> AlignedTranscript:
+    """
+    cache_key: if given, emissions are taken from or written to cache
+    """
+    if cache_key is not None:
+        cache = cache if cache is not None else EmissionsCache()
+        emissions = cache.get(cache_key)
+        if emissions is None:
+            emissions = cache.writing(
+                cache_key, calc_emissions(asr, arrays, batch_size)
+            )
+        else:
+            print(f"found cached emissions for {cache_key}")
+        aligned_transcripts = (decode_emissions(asr, e) for e in emissions)
+    else:
+        aligned_transcripts = transcribe_arrays(asr, arrays, batch_size)
+
+    return glue_transcripts(aligned_transcripts, glue=glue, decoder=asr.decoder)
+
+
 if __name__ == "__main__":
     """
     python asr_segment_glueing.py facebook/wav2vec2-base-960h
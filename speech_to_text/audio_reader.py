@@ -0,0 +1,198 @@
+import queue
+import subprocess
+import threading
+from contextlib import contextmanager
+from tempfile import TemporaryFile
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from scipy.io import wavfile
+
+from speech_to_text.resampling import StreamingResampler
+from speech_to_text.transcribe_audio import TARGET_SAMPLE_RATE
+
+BLOCK_SIZE = 2 ** 16
+MAX_QUEUED_BLOCKS = 32
+
+
+def pcm_to_float(block: np.ndarray) -> np.ndarray:
+    """
+    scales to [-1, 1] like AudioSegment does, channels are averaged
+    """
+    if block.dtype == np.uint8:
+        block = (block.astype(np.float32) - 128) / 128
+    elif np.issubdtype(block.dtype, np.integer):
+        block = block.astype(np.float32) / -np.iinfo(block.dtype).min
+    else:
+        block = block.astype(np.float32)
+    if block.ndim > 1:
+        block = block.mean(axis=1)
+    return block
+
+
+def read_wav_blocks(file, block_size=BLOCK_SIZE) -> Tuple[int, Iterator[np.ndarray]]:
+    """
+    wav is memory-mapped, only one block at a time is read from disk
+    """
+    sample_rate, samples = wavfile.read(file, mmap=True)
+
+    def blocks():
+        for k in range(0, len(samples), block_size):
+            yield pcm_to_float(samples[k : k + block_size])
+
+    return sample_rate, blocks()
+
+
+def resample_blocks(
+    blocks: Iterable[np.ndarray], in_rate: int, out_rate: int
+) -> Iterator[np.ndarray]:
+    if in_rate == out_rate:
+        yield from blocks
+        return
+    resampler = StreamingResampler(in_rate, out_rate).init()
+    for block in blocks:
+        yield resampler.process(block)
+    yield resampler.flush()
+
+
+@contextmanager
+def ffmpeg_process(args: List[str]) -> Iterator[subprocess.Popen]:
+    """
+    ffmpeg writing to its stdout-pipe, raises RuntimeError with ffmpeg's errors if it fails
+    stderr goes to a temporary file, a full stderr-pipe would block ffmpeg
+    ffmpeg is killed if the with-block is left by an exception
+    """
+    args = [str(a) for a in args]
+    errors = TemporaryFile()
+    process = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-loglevel", "error"] + args,
+        stdout=subprocess.PIPE,
+        stderr=errors,
+    )
+    try:
+        yield process
+        if process.wait() != 0:
+            errors.seek(0)
+            raise RuntimeError(
+                f"ffmpeg {' '.join(args)} failed: {errors.read().decode(errors='replace')}"
+            )
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+        errors.close()
+
+
+def ffmpeg_blocks(
+    file, block_size=BLOCK_SIZE, max_queued=MAX_QUEUED_BLOCKS
+) -> Iterator[np.ndarray]:
+    """
+    ffmpeg decodes to 16kHz mono int16 PCM on its stdout, no temporary file is written
+    a thread reads the pipe while the consumer already transcribes,
+    the bounded queue stalls ffmpeg if the consumer is slower
+    """
+    args = ["-i", file, "-vn", "-ac", 1, "-ar", TARGET_SAMPLE_RATE, "-f", "s16le", "-"]
+    with ffmpeg_process(args) as process:
+        blocks = queue.Queue(maxsize=max_queued)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def read_pipe():
+            try:
+                while not stop.is_set():
+                    data = process.stdout.read(2 * block_size)
+                    if len(data) == 0:
+                        break
+                    # a sample might be cut in halves only at very end of stream
+                    put(np.frombuffer(data, dtype=np.int16, count=len(data) // 2))
+            finally:
+                put(None)
+
+        reader = threading.Thread(target=read_pipe, daemon=True)
+        reader.start()
+        finished = False
+        try:
+            while True:
+                block = blocks.get()
+                if block is None:
+                    break
+                yield pcm_to_float(block)
+            finished = True
+        finally:  # if consumer stopped early, ffmpeg is killed to unblock the reader
+            stop.set()
+            if not finished:
+                process.kill()
+            reader.join()
+
+
+def media_duration(file) -> float:
+    """
+    in seconds, as ffprobe reads it from the container
+    """
+    output = subprocess.check_output(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            str(file),
+        ]
+    )
+    return float(output.decode().strip())
+
+
+def read_blocks(file, block_size=BLOCK_SIZE) -> Iterator[np.ndarray]:
+    """
+    float32 mono blocks at TARGET_SAMPLE_RATE
+    wav-files are memory-mapped, any other format (or wav that can not be mapped) is decoded by ffmpeg
+    """
+    if str(file).lower().endswith(".wav"):
+        try:
+            sample_rate, blocks = read_wav_blocks(file, block_size)
+            return resample_blocks(blocks, sample_rate, TARGET_SAMPLE_RATE)
+        except ValueError:  # scipy can not memory-map 24-bit PCM
+            pass
+    return ffmpeg_blocks(file, block_size)
+
+
+def generate_windows(
+    blocks: Iterable[np.ndarray], step: int
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    windows of 2 steps, one starting every step, the last one also takes the rest (less than a step) after it
+    a window is cut as soon as it is known not to be the last one, so at most 3 steps plus a block are buffered
+    """
+    buffer = np.zeros(0, dtype=np.float32)
+    idx = 0  # stream-index of buffer[0], start of next window
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= 3 * step:
+            yield idx, buffer[: 2 * step]
+            buffer = buffer[step:]
+            idx += step
+    if len(buffer) > 0:
+        yield idx, buffer  # last window, shorter than 3 steps
+
+
+def blocks_to_memmap(blocks: Iterable[np.ndarray], file: BinaryIO) -> np.ndarray:
+    """
+    for random access to long audio, like needed by vad, without holding it in memory
+    """
+    num_samples = 0
+    for block in blocks:
+        block.astype(np.float32).tofile(file)
+        num_samples += len(block)
+    file.flush()
+    if num_samples == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(file, dtype=np.float32, mode="r", shape=(num_samples,))
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Tuple
+import numpy as np
+
+from speech_to_text.transcribe_audio import (
+    FramePath,
+    LetterArray,
+    SpeechToText,
+    TARGET_SAMPLE_RATE,
+)
+
+
+@dataclass
+class InferenceScheduler:
+    """
+    collects windows from all concurrent sessions into batches,
+    a batch is closed when it has max_batch_size windows or its first window waited max_wait seconds
+    batches run one after another on a dedicated inference-thread, so the event-loop stays responsive
+    """
+
+    asr: SpeechToText
+    max_batch_size: int = 8
+    max_wait: float = 0.05
+    num_latencies: int = 1000  # for latency-percentiles
+
+    def init(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=self.num_latencies)
+        self._task = None
+        return self
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        self.executor.shutdown(wait=True)
+
+    async def transcribe(self, audio: np.ndarray) -> Tuple[LetterArray, FramePath]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((audio, future, time.monotonic()))
+        return await future
+
+    async def _collect_batch(self):
+        batch = [await self.queue.get()]
+        # waiting behind a running batch counts against max_wait, too
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            self.batch_sizes[len(batch)] += 1
+            try:
+                letters = await loop.run_in_executor(
+                    self.executor,
+                    self.asr.transcribe_audio_arrays_with_frame_paths,
+                    [audio for audio, _, _ in batch],
+                    TARGET_SAMPLE_RATE,
+                )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            done = time.monotonic()
+            for (_, future, submitted), window_letters in zip(batch, letters):
+                self.latencies.append(done - submitted)
+                if not future.done():  # session might have been cancelled
+                    future.set_result(window_letters)
+
+    @property
+    def metrics(self):
+        num_batches = sum(self.batch_sizes.values())
+        num_windows = sum(size * n for size, n in self.batch_sizes.items())
+        latencies = np.array(self.latencies) if len(self.latencies) > 0 else [np.nan]
+        return {
+            "queue_depth": self.queue.qsize(),
+            "num_batches": num_batches,
+            "mean_batch_size": num_windows / max(1, num_batches),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "p50_latency": float(np.percentile(latencies, 50)),
+            "p95_latency": float(np.percentile(latencies, 95)),
+        }
@@ -1,21 +1,348 @@
+import hashlib
+import json
+import os
+import shutil
 import subprocess
 import sys
-sys.path.append(".")
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
 
-from speech_to_text.create_subtitle_files import create_subtitles
+import numpy as np
 
-if __name__ == "__main__":
+sys.path.append(".")
+
+from speech_to_text.audio_reader import ffmpeg_process, media_duration
+from speech_to_text.emissions_cache import evict_lru, file_hash
+
+BURN_CACHE_DIR = os.environ.get("BURN_CACHE_DIR", "burn_cache")
+BURN_CACHE_MAX_GB = float(os.environ.get("BURN_CACHE_MAX_GB", 50.0))
+
+# subtitle-codec per container for soft-subtitles, input ass/srt is copied as is into mkv
+SOFT_SUBTITLE_CODECS = {
+    ".mp4": "mov_text",
+    ".m4v": "mov_text",
+    ".mov": "mov_text",
+    ".mkv": "copy",
+}
+LANGUAGE_CODES = {  # ISO 639-2, as expected by containers' language-tags
+    "english": "eng",
+    "spanish": "spa",
+    "german": "deu",
+    "french": "fra",
+    "italian": "ita",
+    "portuguese": "por",
+    "en": "eng",
+    "es": "spa",
+    "de": "deu",
+    "fr": "fra",
+    "it": "ita",
+    "pt": "por",
+}
+
+
+class FfmpegStopped(Exception):
+    pass
+
+
+def run_ffmpeg(args: List[str], on_time: Optional[Callable[[float], None]] = None):
+    """
+    on_time: called with seconds of output written so far, exceptions raised by it abort ffmpeg
+    """
+    with ffmpeg_process(["-y", "-progress", "pipe:1"] + args) as process:
+        for line in process.stdout:
+            key, _, value = line.decode().strip().partition("=")
+            # out_time_ms is in microseconds, see ffmpeg's -progress
+            if on_time is not None and key == "out_time_ms" and value.isdigit():
+                on_time(int(value) / 1e6)
+
+
+def burn_subtitles(
+    video_file,
+    ass_file,
+    output_file,
+    progress: Optional[Callable[[float], None]] = None,
+):
+    """
+    progress: called with fraction of video that is encoded, exceptions raised by it abort ffmpeg
+    """
+    duration = media_duration(video_file) if progress is not None else None
+    run_ffmpeg(
+        ["-i", video_file, "-vf", f"ass={ass_file}", output_file],
+        on_time=(lambda t: progress(min(1.0, t / duration)))
+        if progress is not None
+        else None,
+    )
+
+
+def language_code(name: str) -> str:
+    return LANGUAGE_CODES.get(name.lower(), "und")
+
+
+def mux_subtitles(
+    video_file,
+    name2subtitle_file: Dict[str, str],
+    output_file,
+    languages: Optional[Dict[str, str]] = None,
+    progress: Optional[Callable[[float], None]] = None,
+):
+    """
+    subtitle-files become separate subtitle-streams titled by their name, video and audio are stream-copied,
+    so this runs at disk-speed, players let viewers switch tracks on and off
+    languages: ISO 639-2 code per name, defaults to language_code of name
+    """
+    suffix = Path(output_file).suffix.lower()
+    assert suffix in SOFT_SUBTITLE_CODECS, f"can not mux subtitles into {suffix}"
+    languages = languages if languages is not None else {}
+    names = list(name2subtitle_file.keys())
+    args = ["-i", video_file]
+    for name in names:
+        args += ["-i", name2subtitle_file[name]]
+    args += ["-map", "0:v?", "-map", "0:a?"]
+    for k in range(len(names)):
+        args += ["-map", f"{k + 1}:0"]
+    args += ["-c:v", "copy", "-c:a", "copy", "-c:s", SOFT_SUBTITLE_CODECS[suffix]]
+    for k, name in enumerate(names):
+        language = languages.get(name, language_code(name))
+        args += [f"-metadata:s:s:{k}", f"language={language}"]
+        args += [f"-metadata:s:s:{k}", f"title={name}"]
+    if len(names) > 0:
+        args += ["-disposition:s:0", "default"]
+    duration = media_duration(video_file) if progress is not None else None
+    run_ffmpeg(
+        args + [output_file],
+        on_time=(lambda t: progress(min(1.0, t / duration)))
+        if progress is not None
+        else None,
+    )
+
+
+def keyframe_times(video_file) -> np.ndarray:
+    """
+    from packet-flags of first video-stream, nothing needs to be decoded
+    """
+    output = subprocess.check_output(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            str(video_file),
+        ]
+    )
+    times = []
+    for line in output.decode().splitlines():
+        pts_time, _, flags = line.partition(",")
+        if flags.startswith("K") and pts_time not in ["", "N/A"]:
+            times.append(float(pts_time))
+    return np.unique(times)
+
+
+def segment_bounds(
+    keyframes: np.ndarray, duration: float, num_segments: int
+) -> List[Tuple[float, float]]:
+    """
+    segments of roughly equal length, each starting at a keyframe
+    """
+    targets = duration * np.arange(1, num_segments) / num_segments
+    idx = np.minimum(np.searchsorted(keyframes, targets), len(keyframes) - 1)
+    starts = np.unique(keyframes[idx]) if len(keyframes) > 0 else np.zeros(0)
+    starts = [0.0] + [float(s) for s in starts if 0.0 < s < duration]
+    return list(zip(starts, starts[1:] + [float(duration)]))
 
-    video_dir = sys.argv[1]
-    transript_dir = sys.argv[2]
-    manual_transcripts_dir = sys.argv[3]
-    name2subfile = {
-        p.stem: str(p) for p in create_subtitles(transript_dir, manual_transcripts_dir)
-    }
-
-    for video_file in Path(video_dir).glob("*.*"):
-        subprocess.check_output(
-            f"/usr/bin/ffmpeg -i {video_file} -vf ass={name2subfile[video_file.stem]} {video_file.stem}_sub.mp4 -y",
-            shell=True,
+
+def burn_subtitles_parallel(
+    video_file,
+    ass_file,
+    output_file,
+    num_workers: int = os.cpu_count(),
+    progress: Optional[Callable[[float], None]] = None,
+):
+    """
+    video is cut at keyframes into num_workers segments, which are burned by separate ffmpeg-processes,
+    timestamps are shifted back to where the segment lies in the video, so that the ass-filter shows the right events
+    segments are concatenated without re-encoding, audio is muxed from the original video
+    """
+    duration = media_duration(video_file)
+    bounds = segment_bounds(keyframe_times(video_file), duration, num_workers)
+    threads = str(max(1, os.cpu_count() // len(bounds)))
+    encoded = np.zeros(len(bounds))
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def on_time(k: int, seconds: float):
+        if stop.is_set():
+            raise FfmpegStopped
+        with lock:
+            encoded[k] = min(seconds, bounds[k][1] - bounds[k][0])
+            if progress is not None:
+                progress(0.99 * encoded.sum() / duration)  # muxing is left
+
+    def burn_segment(k: int, segment_file: str):
+        start, end = bounds[k]
+        run_ffmpeg(
+            [
+                "-ss",
+                f"{start:.6f}",
+                "-i",
+                video_file,
+                "-t",
+                f"{end - start:.6f}",
+                "-an",
+                "-sn",
+                "-vf",
+                f"setpts=PTS+{start:.6f}/TB,ass={ass_file},setpts=PTS-STARTPTS",
+                "-c:v",
+                "libx264",
+                "-threads",
+                threads,
+                segment_file,
+            ],
+            on_time=lambda t: on_time(k, t),
+        )
+
+    with TemporaryDirectory() as tmp_dir:
+        segment_files = [f"{tmp_dir}/segment_{k:04d}.mp4" for k in range(len(bounds))]
+        with ThreadPoolExecutor(num_workers) as executor:
+            futures = [
+                executor.submit(burn_segment, k, f) for k, f in enumerate(segment_files)
+            ]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            stop.set()  # first failure stops the others
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        causes = [e for e in errors if not isinstance(e, FfmpegStopped)]
+        if len(errors) > 0:
+            raise (causes + errors)[0]
+
+        concat_list = f"{tmp_dir}/segments.txt"
+        with open(concat_list, "w") as f:
+            f.writelines(f"file '{s}'\n" for s in segment_files)
+        run_ffmpeg(
+            [
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                concat_list,
+                "-i",
+                video_file,
+                "-map",
+                "0:v:0",
+                "-map",
+                "1:a?",
+                "-c:v",
+                "copy",
+                "-c:a",
+                "copy",
+                output_file,
+            ]
         )
+    if progress is not None:
+        progress(1.0)
+
+
+_video_hashes: Dict[Tuple[str, int, float], str] = {}
+
+
+def burn_key(video_file, ass_file, styles: dict) -> str:
+    """
+    styles: style-config the ass-file was created with
+    video-hashes are remembered per path, size and mtime, hashing an hour of video takes seconds
+    """
+    stat = os.stat(video_file)
+    video_id = (str(Path(video_file).resolve()), stat.st_size, stat.st_mtime)
+    if video_id not in _video_hashes:
+        _video_hashes[video_id] = file_hash(video_file)
+    h = hashlib.sha1(_video_hashes[video_id].encode("utf-8"))
+    h.update(file_hash(ass_file).encode("utf-8"))
+    h.update(json.dumps(styles, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+@dataclass
+class BurnCache:
+    """
+    one video-file per key, written under a temporary name and renamed into place
+    least recently used entries are evicted when max_bytes is exceeded
+    """
+
+    cache_dir: str = BURN_CACHE_DIR
+    max_bytes: int = round(BURN_CACHE_MAX_GB * 1024 ** 3)
+
+    def get(self, key: str) -> Optional[str]:
+        file = f"{self.cache_dir}/{key}.mp4"
+        if not os.path.isfile(file):
+            return None
+        os.utime(file)
+        return file
+
+    def put(self, key: str, render: Callable[[str], None]) -> str:
+        """
+        render: writes video to the file-name it gets
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = f"{self.cache_dir}/tmp-{uuid4().hex}.mp4"
+        file = f"{self.cache_dir}/{key}.mp4"
+        try:
+            render(tmp_file)
+            os.replace(tmp_file, file)
+        finally:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+        evict_lru(self.cache_dir, self.max_bytes, keep=file)
+        return file
+
+
+def burn_subtitles_cached(
+    video_file,
+    ass_file,
+    output_file,
+    styles: dict,
+    num_workers: int = 1,
+    cache: Optional[BurnCache] = None,
+    progress: Optional[Callable[[float], None]] = None,
+):
+    """
+    output for same video, ass-file and styles is copied from cache instead of burned again
+    num_workers: if > 1 see burn_subtitles_parallel
+    """
+    cache = cache if cache is not None else BurnCache()
+    key = burn_key(video_file, ass_file, styles)
+    cached_file = cache.get(key)
+    if cached_file is None:
+        if num_workers > 1:
+            render = lambda f: burn_subtitles_parallel(
+                video_file, ass_file, f, num_workers, progress
+            )
+        else:
+            render = lambda f: burn_subtitles(video_file, ass_file, f, progress)
+        cached_file = cache.put(key, render)
+    else:
+        print(f"found cached video for {key}")
+    shutil.copyfile(cached_file, output_file)  # a hard-link would be clobbered by writers of output_file
+    if progress is not None:
+        progress(1.0)
+
+
+if __name__ == "__main__":
+    """
+    python speech_to_text/burn_subtitles_into_video.py <video_file> <ass_file> <output_file> [num_workers]
+    """
+    burn_subtitles_cached(
+        sys.argv[1],
+        sys.argv[2],
+        sys.argv[3],
+        styles={},
+        num_workers=int(sys.argv[4]) if len(sys.argv) > 4 else 1,
+        progress=lambda p: print(f"{100 * p:.0f}%", end="\r"),
+    )
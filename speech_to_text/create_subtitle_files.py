@@ -8,18 +8,20 @@ from dataclasses import dataclass
 from pysubs2 import SSAFile, Color, SSAEvent
 from pysubs2.time import make_time
 from scipy.interpolate import interp1d
-from text_processing.smith_waterman_alignment import smith_waterman_alignment
 
 sys.path.append(".")
 
 from pathlib import Path
 
-from util import data_io
-
 import difflib
-from typing import List, Generator, Tuple, Dict
+from typing import List, Generator, Tuple, Dict, Optional
+
+import numpy as np
 
+from speech_to_text.letters_file import load_letters
+from speech_to_text.token_alignment import align_tokens
 from speech_to_text.transcribe_audio import (
+    LetterArray,
     LetterIdx,
     TARGET_SAMPLE_RATE,
 )
@@ -58,34 +60,97 @@ def build_srt_block(
 
 
 def cut_block_out_of_transcript(
-    transcripts: List[Tuple[str, List[LetterIdx]]], block_start, block_end
-):
-    def tokenize_letters(lettas: List[LetterIdx]):
-        buffer = []
-        for l in lettas:
-            if l.letter != FORCE_BREAK:
-                buffer.append(l)
-            if l.letter == " ":
-                yield buffer
-                buffer = []
-        if len(buffer)>0:
-            yield buffer
-
-    name2block = {
-        name: [
-            l
-            for tok in tokenize_letters(letters)
-            if tok[0].r_idx >= block_start and tok[0].r_idx < block_end
-            for l in tok
-        ]
+    transcripts: List[Tuple[str, LetterArray]], block_start, block_end
+) -> Dict[str, LetterArray]:
+    """
+    to cut many blocks use SubtitleIndex, which indexes the transcripts only once
+    """
+    return {
+        name: TokenIndex.from_letters(letters).cut(block_start, block_end)
         for name, letters in transcripts
     }
-    return name2block
 
 
 FORCE_BREAK = "|"
 
 
+@dataclass(eq=False)
+class TokenIndex:
+    """
+    tokens end with a space, FORCE_BREAKs are dropped
+    a token belongs to a block if its first letter lies within it,
+    token-starts are sorted by sample-index, so blocks are found by searchsorted
+    """
+
+    letters: LetterArray
+    token_starts: np.ndarray  # letter-offset of each token
+    token_r_idx: np.ndarray  # sample-index of first letter of each token
+
+    @classmethod
+    def from_letters(cls, letters: LetterArray):
+        keep = letters.codepoints != ord(FORCE_BREAK)
+        letters = LetterArray(letters.codepoints[keep], letters.r_idx[keep])
+        after_space = np.flatnonzero(letters.codepoints == ord(" ")) + 1
+        token_starts = np.concatenate(
+            [[0], after_space[after_space < len(letters)]]
+        ).astype(np.int64)
+        if len(letters) == 0:
+            token_starts = token_starts[:0]
+        token_r_idx = letters.r_idx[token_starts]
+        assert np.all(np.diff(token_r_idx) >= 0)
+        return cls(letters, token_starts, token_r_idx)
+
+    def letter_ranges(self, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        letter-offsets of blocks given by sample-indizes start <= token-start < end
+        """
+        bounds = np.append(self.token_starts, len(self.letters))
+        token_from = np.searchsorted(self.token_r_idx, starts, side="left")
+        token_to = np.searchsorted(self.token_r_idx, ends, side="left")
+        return bounds[token_from], bounds[np.maximum(token_from, token_to)]
+
+    def cut(self, start: int, end: int) -> LetterArray:
+        letter_from, letter_to = self.letter_ranges([start], [end])
+        return self.letters[letter_from[0] : letter_to[0]]
+
+
+@dataclass(eq=False)
+class SubtitleIndex:
+    """
+    blocks are segmented by generate_block_start_ends on the first transcript
+    and cut out of all transcripts with their TokenIndex
+    """
+
+    names: List[str]
+    token_indizes: List[TokenIndex]
+    block_starts: np.ndarray  # sample-indizes
+    block_ends: np.ndarray
+
+    @classmethod
+    def from_transcripts(cls, transcripts: List[Tuple[str, LetterArray]]):
+        _, first = transcripts[0]
+        start_ends = np.array(list(generate_block_start_ends(first)), dtype=np.int64)
+        return cls(
+            [name for name, _ in transcripts],
+            [TokenIndex.from_letters(letters) for _, letters in transcripts],
+            start_ends[:, 0],
+            start_ends[:, 1],
+        )
+
+    def blocks(self) -> List[Dict[str, LetterArray]]:
+        name2ranges = {
+            name: index.letter_ranges(self.block_starts, self.block_ends)
+            for name, index in zip(self.names, self.token_indizes)
+        }
+        return [
+            {
+                name: index.letters[name2ranges[name][0][k] : name2ranges[name][1][k]]
+                for name, index in zip(self.names, self.token_indizes)
+            }
+            for k in range(len(self.block_starts))
+        ]
+
+
 def generate_block_start_ends(
     letters: List[LetterIdx],
 ) -> Generator[int, None, None]:
@@ -171,6 +236,27 @@ def create_ass_file(subtitle_blocks: List[SubtitleBlock], ass_file,styles:Dict[s
     subs.save(ass_file)
 
 
+def create_subtitle_track_files(
+    subtitle_blocks: List[SubtitleBlock],
+    file_prefix,
+    styles: Dict[str, StyleConfig],
+    suffix=".ass",
+) -> Dict[str, str]:
+    """
+    one file per transcript-name, to be muxed as separate subtitle-streams instead of being burned into the video
+    suffix: .ass keeps styles, .srt is plain text
+    """
+    name2file = {}
+    for name in subtitle_blocks[0].names:
+        blocks = [
+            SubtitleBlock(sb.start, sb.end, [(n, t) for n, t in sb.name_texts if n == name])
+            for sb in subtitle_blocks
+        ]
+        name2file[name] = f"{file_prefix}_{name}{suffix}"
+        create_ass_file(blocks, name2file[name], styles)
+    return name2file
+
+
 @dataclass
 class TranslatedTranscript:
     """
@@ -180,33 +266,29 @@ class TranslatedTranscript:
     name: str
     order: int
     text: str
+    pivot: Optional[str] = None  # name of transcript to align onto, see AlignmentPlanner
 
 
 def segment_transcript_to_subtitle_blocks(
-    transcript_letters_csv, translated_transcript: List[TranslatedTranscript]
-) -> List[Dict[str, List[LetterIdx]]]:
-    g = (line.split("\t") for line in data_io.read_lines(str(transcript_letters_csv)))
-    raw_letters = [LetterIdx(l, int(i)) for l, i in g]
-    assert all(
-        (
-            raw_letters[k].r_idx > raw_letters[k - 1].r_idx
-            for k in range(1, len(raw_letters))
-        )
-    )
+    transcript_letters_file,
+    translated_transcript: List[TranslatedTranscript],
+    planner=None,
+) -> List[Dict[str, LetterArray]]:
+    """
+    planner: optional AlignmentPlanner, without one each transcript is aligned onto the spoken letters
+    """
+    raw_letters = load_letters(transcript_letters_file).letters
+    assert np.all(np.diff(raw_letters.r_idx) >= 0)
+
+    if planner is not None:
+        subtitles = planner.align(raw_letters, translated_transcript)
+    else:
+        subtitles = [
+            (tt.name, temporal_align_text_to_letters(tt.text, raw_letters))
+            for tt in sorted(translated_transcript, key=lambda x: x.order)
+        ]
 
-    subtitles = []
-    letters = raw_letters
-    for tt in sorted(translated_transcript, key=lambda x: x.order):
-        aligned_letters = temporal_align_text_to_letters(tt.text, letters)
-        subtitles.append((tt.name, aligned_letters))
-        letters = aligned_letters  # align next transcript on already aligned, heuristic is to use language-similarities: native->spanish->english->german
-
-    _, first_aligned = subtitles[0]
-    named_blocks = [
-        cut_block_out_of_transcript(subtitles, s, e)
-        for s, e in generate_block_start_ends(first_aligned)
-    ]
-    return named_blocks
+    return SubtitleIndex.from_transcripts(subtitles).blocks()
 
 
 def create_timestamp(index):
@@ -221,18 +303,24 @@ def regex_tokenizer(
 
 def temporal_align_text_to_letters(
     corrected_transcript: str,
-    raw_letters: List[LetterIdx],
-):
+    raw_letters: LetterArray,
+    num_workers: int = 1,
+) -> LetterArray:
+    """
+    num_workers: see align_tokens
+    """
     START = "<start>"
     END = "<end>"
     add_start_end = lambda x: f"{START}{x}{END}"
-    raw_letters = (
-        [LetterIdx(s, raw_letters[0].r_idx) for s in START]
-        + raw_letters
-        + [LetterIdx(s, raw_letters[-1].r_idx) for s in END]
+    raw_letters = LetterArray.concat(
+        [
+            LetterArray.from_text(START, [raw_letters.r_idx[0]] * len(START)),
+            raw_letters,
+            LetterArray.from_text(END, [raw_letters.r_idx[-1]] * len(END)),
+        ]
     )
 
-    raw_transcript = "".join([l.letter for l in raw_letters])
+    raw_transcript = raw_letters.text
     # raw_transcript = add_start_end(raw_transcript)
     corrected_transcript = add_start_end(corrected_transcript)
     corrected_transcript = re.sub(r"\n+", f" {FORCE_BREAK} ", corrected_transcript)
@@ -246,29 +334,38 @@ def temporal_align_text_to_letters(
     tok2letter_idx_b = {k: start_idx for k, (start_idx, _, _) in enumerate(tokens_b)}
     tok2letter_idx_b[len(tokens_b)] = len(corrected_transcript) + 1
 
-    alignments, _ = smith_waterman_alignment(
-        [t.lower() for _, _, t in tokens_a], [t.lower() for _, _, t in tokens_b]
+    matches = align_tokens(
+        [t.lower() for _, _, t in tokens_a],
+        [t.lower() for _, _, t in tokens_b],
+        num_workers=num_workers,
     )
-    matches = [al for al in alignments if al.ref == al.hyp]
     print_for_debug(matches, raw_transcript, tok2letter_idx_a)
 
-    raw_letters += [raw_letters[-1]]
-    matched2index = {
-        tok2letter_idx_b[al.hypi_from]
-        + k: raw_letters[tok2letter_idx_a[al.refi_from] + k].r_idx
-        for al in matches
-        for k in range(tok2letter_idx_a[al.refi_to] - tok2letter_idx_a[al.refi_from])
-    }
-    x = list(matched2index.keys())
-    y = list(matched2index.values())
-    interp_fun = interp1d(x, y)
-    letters = [
-        LetterIdx(l, int(matched2index.get(k, interp_fun(k))))
-        for k, l in enumerate(corrected_transcript)
+    raw_idx = np.append(raw_letters.r_idx, raw_letters.r_idx[-1])
+    sizes = [
+        tok2letter_idx_a[al.refi_to] - tok2letter_idx_a[al.refi_from] for al in matches
     ]
-    assert all(
-        (letters[k].r_idx >= letters[k - 1].r_idx for k in range(1, len(letters)))
+    matched_b = np.concatenate(
+        [
+            np.arange(tok2letter_idx_b[al.hypi_from], tok2letter_idx_b[al.hypi_from] + n)
+            for al, n in zip(matches, sizes)
+        ]
     )
+    matched_a = np.concatenate(
+        [
+            np.arange(tok2letter_idx_a[al.refi_from], tok2letter_idx_a[al.refi_from] + n)
+            for al, n in zip(matches, sizes)
+        ]
+    )
+    # if letters got matched multiple times, last match wins
+    x, last = np.unique(matched_b[::-1], return_index=True)
+    y = raw_idx[matched_a[::-1][last]]
+    interp_fun = interp1d(x, y)
+    r_idx = interp_fun(np.arange(len(corrected_transcript)))
+    within = x < len(corrected_transcript)
+    r_idx[x[within]] = y[within]
+    letters = LetterArray.from_text(corrected_transcript, r_idx.astype(np.int64))
+    assert np.all(np.diff(letters.r_idx) >= 0)
     return letters[len(START) : -len(END)]
 
 
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+from uuid import uuid4
+
+import numpy as np
+
+EMISSIONS_CACHE_DIR = os.environ.get("EMISSIONS_CACHE_DIR", "emissions_cache")
+EMISSIONS_CACHE_MAX_GB = float(os.environ.get("EMISSIONS_CACHE_MAX_GB", 10.0))
+
+
+def file_hash(file, block_size=2 ** 20) -> str:
+    h = hashlib.sha1()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_emissions_key(file, params: dict) -> str:
+    """
+    params: everything besides the audio that the emissions depend on, like model_name and window-parameters
+    the file's bytes are hashed, so the key is known before the audio is decoded
+    """
+    h = hashlib.sha1(file_hash(file).encode("utf-8"))
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def evict_lru(cache_dir, max_bytes: int, keep: Optional[str] = None):
+    """
+    removes least recently used (by mtime, which cache-hits touch) entries of cache_dir, files or directories,
+    until all entries' sizes sum up to at most max_bytes
+    temporary entries (tmp-*) and keep are never removed, keep's size is counted though
+    """
+    entries = []
+    total = 0
+    for p in Path(cache_dir).iterdir():
+        if p.name.startswith("tmp-"):
+            continue
+        try:
+            if p.is_dir():
+                size = sum(f.stat().st_size for f in p.iterdir())
+            else:
+                size = p.stat().st_size
+            total += size
+            if keep is None or p != Path(keep):
+                entries.append((p.stat().st_mtime, size, p))
+        except FileNotFoundError:  # concurrently evicted
+            pass
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        total -= size
+
+
+@dataclass
+class WindowEmissions:
+    start_idx: int
+    input_len: int  # length of window-array the logits were calculated from
+    logits: np.ndarray  # [T, N]
+
+
+@dataclass
+class EmissionsCache:
+    """
+    one directory per key holding all windows' logits as raw float16-file
+    entries are written to a temporary directory and renamed into place, so concurrent writers don't clobber each other
+    least recently used entries are evicted when max_bytes is exceeded
+    """
+
+    cache_dir: str = EMISSIONS_CACHE_DIR
+    max_bytes: int = round(EMISSIONS_CACHE_MAX_GB * 1024 ** 3)
+
+    def get(self, key: str) -> Optional[List[WindowEmissions]]:
+        entry_dir = f"{self.cache_dir}/{key}"
+        if not os.path.isdir(entry_dir):
+            return None
+        if not os.path.isfile(f"{entry_dir}/logits.f16"):  # written by older version
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        windows = np.load(f"{entry_dir}/windows.npy")
+        os.utime(entry_dir)
+        if len(windows) == 0:
+            return []
+        logits = np.memmap(f"{entry_dir}/logits.f16", dtype=np.float16, mode="r")
+        logits = logits.reshape(windows[-1, 3], -1)
+        return [
+            WindowEmissions(start_idx, input_len, logits[frame_start:frame_end])
+            for start_idx, input_len, frame_start, frame_end in windows.tolist()
+        ]
+
+    def put(self, key: str, emissions: Iterable[WindowEmissions]):
+        for _ in self.writing(key, emissions):
+            pass
+
+    def writing(
+        self, key: str, emissions: Iterable[WindowEmissions]
+    ) -> Iterator[WindowEmissions]:
+        """
+        passes emissions through while appending them to the entry, which is completed once all went through
+        """
+        tmp_dir = f"{self.cache_dir}/tmp-{uuid4().hex}"
+        os.makedirs(tmp_dir)
+        windows = []
+        frame_end = 0
+        try:
+            with open(f"{tmp_dir}/logits.f16", "wb") as f:
+                for e in emissions:
+                    np.asarray(e.logits, dtype=np.float16).tofile(f)
+                    frame_end += len(e.logits)
+                    windows.append(
+                        (e.start_idx, e.input_len, frame_end - len(e.logits), frame_end)
+                    )
+                    yield e
+            np.save(f"{tmp_dir}/windows.npy", np.array(windows, dtype=np.int64))
+            try:
+                os.rename(tmp_dir, f"{self.cache_dir}/{key}")
+            except OSError:  # concurrently written by someone else
+                pass
+        finally:  # also if consumer stopped early
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        evict_lru(self.cache_dir, self.max_bytes, keep=f"{self.cache_dir}/{key}")
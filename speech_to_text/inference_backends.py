@@ -0,0 +1,175 @@
+import os
+import sys
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import torch
+from transformers import Wav2Vec2ForCTC
+
+sys.path.append(".")
+
+BACKENDS = ["eager", "torchscript", "onnx"]
+EXPORTED_MODELS_DIR = os.environ.get("EXPORTED_MODELS_DIR", "exported_models")
+EXPORT_SAMPLE_RATE = 16_000
+
+
+def exported_model_file(
+    model_name: str, backend: str, exported_models_dir: str = EXPORTED_MODELS_DIR
+) -> str:
+    suffix = {"torchscript": "pt", "onnx": "onnx"}[backend]
+    return f"{exported_models_dir}/{model_name.replace('/', '_')}.{suffix}"
+
+
+def feat_extract_output_lengths(config, input_lengths: torch.Tensor) -> torch.Tensor:
+    """
+    number of logits-frames the conv-feature-extractor produces, same as Wav2Vec2ForCTC._get_feat_extract_output_lengths
+    """
+    for kernel_size, stride in zip(config.conv_kernel, config.conv_stride):
+        input_lengths = (
+            torch.div(input_lengths - kernel_size, stride, rounding_mode="floor") + 1
+        )
+    return input_lengths
+
+
+@dataclass
+class EagerBackend:
+    model: Wav2Vec2ForCTC
+    bf16_autocast: bool = False
+
+    def __call__(self, input_values: torch.Tensor, attention_mask: torch.Tensor):
+        with torch.no_grad(), torch.autocast(
+            "cpu", dtype=torch.bfloat16, enabled=self.bf16_autocast
+        ):
+            logits = self.model(input_values, attention_mask=attention_mask).logits
+        return logits.float()
+
+
+@dataclass
+class TorchScriptBackend:
+    model_file: str
+
+    def init(self):
+        self.model = torch.jit.load(self.model_file)
+        return self
+
+    def __call__(self, input_values: torch.Tensor, attention_mask: torch.Tensor):
+        with torch.no_grad():
+            return self.model(input_values, attention_mask)
+
+
+@dataclass
+class OnnxBackend:
+    model_file: str
+    num_threads: Optional[int] = None
+
+    def init(self):
+        import onnxruntime  # only needed for this backend
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if self.num_threads is not None:
+            options.intra_op_num_threads = self.num_threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            self.model_file, options, providers=["CPUExecutionProvider"]
+        )
+        return self
+
+    def __call__(self, input_values: torch.Tensor, attention_mask: torch.Tensor):
+        (logits,) = self.session.run(
+            ["logits"],
+            {
+                "input_values": input_values.numpy(),
+                "attention_mask": attention_mask.numpy().astype(np.int64),
+            },
+        )
+        return torch.from_numpy(logits)
+
+
+class LogitsOnly(torch.nn.Module):
+    def __init__(self, model: Wav2Vec2ForCTC):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values: torch.Tensor, attention_mask: torch.Tensor):
+        return self.model(
+            input_values, attention_mask=attention_mask, return_dict=False
+        )[0]
+
+
+def export_model(model_name: str, backend: str, model_file: str):
+    """
+    traced with batch of two differently padded arrays, time-axis stays dynamic
+    """
+    model = LogitsOnly(Wav2Vec2ForCTC.from_pretrained(model_name)).eval()
+    input_values = torch.randn(2, 2 * EXPORT_SAMPLE_RATE)
+    attention_mask = torch.ones(2, 2 * EXPORT_SAMPLE_RATE, dtype=torch.long)
+    attention_mask[1, EXPORT_SAMPLE_RATE:] = 0
+
+    os.makedirs(os.path.dirname(model_file) or ".", exist_ok=True)
+    if backend == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, (input_values, attention_mask))
+        torch.jit.optimize_for_inference(traced).save(model_file)
+    elif backend == "onnx":
+        torch.onnx.export(
+            model,
+            (input_values, attention_mask),
+            model_file,
+            input_names=["input_values", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_values": {0: "batch", 1: "time"},
+                "attention_mask": {0: "batch", 1: "time"},
+                "logits": {0: "batch", 1: "frames"},
+            },
+            opset_version=14,
+        )
+    else:
+        raise ValueError(
+            f"unknown backend {backend!r}, expected one of {[b for b in BACKENDS if b != 'eager']}"
+        )
+
+
+if __name__ == "__main__":
+    """
+    python speech_to_text/inference_backends.py facebook/wav2vec2-base-960h onnx
+    exports model and compares its logits against the eager model
+    """
+    from scipy.io import wavfile
+
+    from speech_to_text.transcribe_audio import SpeechToText
+
+    model_name = sys.argv[1]
+    backend = sys.argv[2]
+    exported_models_dir = sys.argv[3] if len(sys.argv) > 3 else EXPORTED_MODELS_DIR
+    model_file = exported_model_file(model_name, backend, exported_models_dir)
+    export_model(model_name, backend, model_file)
+    print(f"exported {model_name} to {model_file}")
+
+    eager = SpeechToText(model_name=model_name).init()
+    exported = SpeechToText(
+        model_name=model_name,
+        backend=backend,
+        exported_models_dir=exported_models_dir,
+    ).init()
+
+    sample_rate, samples = wavfile.read(
+        "tests/resources/LibriSpeech_dev-other_116_288046_116-288046-0011.wav"
+    )
+    assert sample_rate == EXPORT_SAMPLE_RATE
+    audios = [samples[: round(dur * sample_rate)] for dur in [0.7, 3.3, 10.0]]
+    for name, batch in [("single", audios[-1:]), ("padded-batch", audios)]:
+        for l_eager, l_exported in zip(
+            eager._calc_logits_batch(batch, EXPORT_SAMPLE_RATE),
+            exported._calc_logits_batch(batch, EXPORT_SAMPLE_RATE),
+        ):
+            assert l_eager.shape == l_exported.shape
+            max_diff = torch.max(torch.abs(l_eager - l_exported)).item()
+            same_path = torch.equal(l_eager.argmax(-1), l_exported.argmax(-1))
+            print(
+                f"{name}: frames: {l_eager.shape[1]}, max-abs-diff: {max_diff:.2e}, same greedy-path: {same_path}"
+            )
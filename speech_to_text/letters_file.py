@@ -0,0 +1,127 @@
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+sys.path.append(".")
+
+from util import data_io
+
+from speech_to_text.transcribe_audio import (
+    AlignedTranscript,
+    LetterArray,
+    TARGET_SAMPLE_RATE,
+)
+
+MAGIC = b"S2TLETTR"
+VERSION = 1
+LETTERS_SUFFIX = ".letters"
+
+
+def _aligned(offset: int, alignment=8) -> int:
+    return -(-offset // alignment) * alignment
+
+
+def write_letters_file(file, transcript: AlignedTranscript, meta: dict):
+    """
+    MAGIC | uint32 header-length | json-header | codepoints uint32[n] | sample-indizes int64[n]
+    header holds version, sample_rate, num_letters and meta (model and transcription-parameters),
+    arrays are 8-byte aligned so that they can be memory-mapped
+    """
+    letters = transcript.letters
+    header = json.dumps(
+        {
+            "version": VERSION,
+            "sample_rate": transcript.sample_rate,
+            "num_letters": len(letters),
+            "meta": meta,
+        }
+    ).encode("utf-8")
+    codepoints_offset = _aligned(len(MAGIC) + 4 + len(header))
+    r_idx_offset = _aligned(codepoints_offset + 4 * len(letters))
+    with open(file, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(b"\0" * (codepoints_offset - f.tell()))
+        f.write(letters.codepoints.astype("<u4").tobytes())
+        f.write(b"\0" * (r_idx_offset - f.tell()))
+        f.write(letters.r_idx.astype("<i8").tobytes())
+
+
+def read_letters_file(file) -> Tuple[AlignedTranscript, dict]:
+    """
+    letters are memory-mapped, returns transcript and meta
+    """
+    with open(file, "rb") as f:
+        magic = f.read(len(MAGIC))
+        assert magic == MAGIC, f"{file} is not a letters-file"
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    assert header["version"] == VERSION
+    n = header["num_letters"]
+    codepoints_offset = _aligned(len(MAGIC) + 4 + header_len)
+    r_idx_offset = _aligned(codepoints_offset + 4 * n)
+    if n == 0:  # mmap can not map empty arrays
+        letters = LetterArray.from_text("", [])
+    else:
+        letters = LetterArray(
+            np.memmap(file, dtype="<u4", mode="r", offset=codepoints_offset, shape=(n,)),
+            np.memmap(file, dtype="<i8", mode="r", offset=r_idx_offset, shape=(n,)),
+        )
+    return AlignedTranscript(letters, header["sample_rate"]), header["meta"]
+
+
+def read_letters_csv(csv_file) -> AlignedTranscript:
+    """
+    older format: one letter<tab>index line per letter
+    """
+    lines = list(data_io.read_lines(str(csv_file)))
+    if len(lines) == 0:
+        return AlignedTranscript(LetterArray.from_text("", []), TARGET_SAMPLE_RATE)
+    letters, indizes = zip(*(line.split("\t") for line in lines))
+    return AlignedTranscript(
+        LetterArray.from_text("".join(letters), np.array(indizes, dtype=np.int64)),
+        TARGET_SAMPLE_RATE,
+    )
+
+
+def convert_csv(csv_file) -> str:
+    """
+    writes letters-file next to csv-file, meta is taken from a _meta.json next to it if there is one
+    """
+    csv_file = Path(csv_file)
+    meta = {}
+    for stem in [csv_file.stem, csv_file.stem.replace("_letters", "")]:
+        meta_file = csv_file.parent / f"{stem}_meta.json"
+        if meta_file.is_file():
+            meta = data_io.read_json(str(meta_file))
+            break
+    letters_file = str(csv_file.with_suffix(LETTERS_SUFFIX))
+    write_letters_file(letters_file, read_letters_csv(csv_file), meta)
+    return letters_file
+
+
+def load_letters(file) -> AlignedTranscript:
+    """
+    if there is only a csv-file (older format) with same name, it gets converted once
+    """
+    file = str(file)
+    csv_file = str(Path(file).with_suffix(".csv"))
+    if not os.path.isfile(file) and os.path.isfile(csv_file):
+        convert_csv(csv_file)
+    transcript, _ = read_letters_file(file)
+    return transcript
+
+
+if __name__ == "__main__":
+    """
+    converts csv-files to letters-files
+    python speech_to_text/letters_file.py <csv-file or directory> ...
+    """
+    for arg in sys.argv[1:]:
+        csv_files = sorted(Path(arg).glob("*.csv")) if os.path.isdir(arg) else [arg]
+        for csv_file in csv_files:
+            print(f"converted {csv_file} to {convert_csv(csv_file)}")
@@ -0,0 +1,90 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import torch
+
+from speech_to_text.transcribe_audio import SpeechToText, effective_precision
+
+MODEL_POOL_MAX_GB = float(os.environ.get("MODEL_POOL_MAX_GB", 8.0))
+
+
+def model_memory_bytes(asr: SpeechToText) -> int:
+    if asr.model is None:  # exported backend
+        return os.path.getsize(asr.engine.model_file)
+    # dynamically quantized Linear-layers keep (weight, bias) as tuple in state_dict
+    tensors = itertools.chain.from_iterable(
+        v if isinstance(v, tuple) else [v] for v in asr.model.state_dict().values()
+    )
+    return sum(
+        t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor)
+    )
+
+
+@dataclass
+class SpeechToTextPool:
+    """
+    process-wide registry of initialized SpeechToText-models keyed by model_name, precision and backend
+    models are loaded lazily, least recently used ones are evicted when max_bytes is exceeded
+    the most recently requested model is never evicted, even if it alone exceeds max_bytes
+    """
+
+    max_bytes: int
+
+    def init(self):
+        self._models: "OrderedDict[Tuple[str, str, str], SpeechToText]" = OrderedDict()
+        self._sizes: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+        self._loading_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        return self
+
+    def get(
+        self, model_name: str, precision: str = "fp32", backend: str = "eager"
+    ) -> SpeechToText:
+        precision = effective_precision(precision)  # same model as fp32 if bf16 is not supported
+        key = (model_name, precision, backend)
+        with self._lock:
+            asr = self._lookup(key)
+            if asr is not None:
+                return asr
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        with loading_lock:  # concurrent requests for same model wait for one load
+            with self._lock:
+                asr = self._lookup(key)
+                if asr is not None:
+                    return asr
+
+            print(f"loading {model_name} with precision {precision} and {backend} backend")
+            asr = SpeechToText(
+                model_name=model_name, precision=precision, backend=backend
+            ).init()
+
+            with self._lock:
+                self._models[key] = asr
+                self._sizes[key] = model_memory_bytes(asr)
+                self._loading_locks.pop(key)
+                self._evict()
+        return asr
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def _lookup(self, key: Tuple[str, str, str]):
+        asr = self._models.get(key)
+        if asr is not None:
+            self._models.move_to_end(key)
+        return asr
+
+    def _evict(self):
+        while self.resident_bytes > self.max_bytes and len(self._models) > 1:
+            key, _ = self._models.popitem(last=False)
+            self._sizes.pop(key)
+            print(f"evicted {key} from model-pool")
+
+
+MODEL_POOL = SpeechToTextPool(max_bytes=round(MODEL_POOL_MAX_GB * 1024 ** 3)).init()
@@ -0,0 +1,57 @@
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(".")
+
+from speech_to_text.asr_segment_glueing import transcribe_audio_file
+from speech_to_text.model_pool import model_memory_bytes
+from speech_to_text.transcribe_audio import SpeechToText, PRECISIONS
+
+
+def char_edit_distance(ref: str, hyp: str) -> int:
+    hyp_chars = np.array(list(hyp))
+    row = np.arange(len(hyp) + 1)
+    for i, r in enumerate(ref, start=1):
+        prev_row = row
+        row = np.empty_like(prev_row)
+        row[0] = i
+        substitutions = prev_row[:-1] + (hyp_chars != r)
+        deletions = prev_row[1:] + 1
+        row[1:] = np.minimum(substitutions, deletions)
+        for j in range(1, len(row)):  # insertions depend on left neighbour
+            row[j] = min(row[j], row[j - 1] + 1)
+    return int(row[-1])
+
+
+if __name__ == "__main__":
+    """
+    python speech_to_text/precision_check.py jonatasgrosman/wav2vec2-large-xlsr-53-english
+    reports character-level difference of reduced precisions to fp32
+    """
+    model = sys.argv[1]
+    resources_dir = sys.argv[2] if len(sys.argv) > 2 else "tests/resources"
+    files = sorted(Path(resources_dir).glob("*.wav"))
+    assert len(files) > 0
+
+    fp32_hyps = {}
+    for precision in PRECISIONS:
+        asr = SpeechToText(model_name=model, precision=precision).init()
+        if asr.precision != precision:
+            print(f"skipping {precision}, not supported")
+            continue
+        start = time.time()
+        hyps = {f.name: transcribe_audio_file(asr, str(f)).text for f in files}
+        duration = time.time() - start
+        if precision == "fp32":
+            fp32_hyps = hyps
+
+        num_chars = sum(len(h) for h in fp32_hyps.values())
+        num_errors = sum(char_edit_distance(fp32_hyps[n], h) for n, h in hyps.items())
+        print(
+            f"{precision}: char-diff to fp32: {num_errors / num_chars:.2%}, "
+            f"took {duration:.1f} seconds, "
+            f"model-size: {model_memory_bytes(asr) / 1024 ** 2:.0f} MB"
+        )
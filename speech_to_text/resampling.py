@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from scipy.signal import firwin
+
+NUM_ZERO_CROSSINGS = 16
+ROLLOFF = 0.945
+KAISER_BETA = 8.0
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter_bank(in_rate: int, out_rate: int) -> np.ndarray:
+    """
+    windowed-sinc lowpass at the upsampled rate, split into its up-many phases
+    row p holds the taps applied to input-samples [q - half, ..., q + half]
+    for an output-sample at upsampled position q * up + p
+    bank is read-only cause it is shared by all resamplers with same rates
+    """
+    g = gcd(in_rate, out_rate)
+    up, down = out_rate // g, in_rate // g
+    half = int(np.ceil(NUM_ZERO_CROSSINGS * max(up, down) / up))
+    center = half * up
+    h = firwin(2 * center + 1, ROLLOFF / max(up, down), window=("kaiser", KAISER_BETA))
+    h = np.concatenate([h * up, np.zeros(up)]).astype(np.float32)
+    taps = np.arange(-half, half + 1)
+    bank = h[center + np.arange(up)[:, None] - taps[None, :] * up]
+    bank.flags.writeable = False
+    return bank
+
+
+@dataclass
+class StreamingResampler:
+    """
+    resamples audio chunk by chunk, concatenated outputs are identical to resampling all audio at once
+    output-samples are emitted as soon as all input-samples they depend on arrived,
+    flush emits the remaining ones at end of stream
+    """
+
+    in_rate: int
+    out_rate: int
+
+    def init(self):
+        g = gcd(self.in_rate, self.out_rate)
+        self.up, self.down = self.out_rate // g, self.in_rate // g
+        self.bank = polyphase_filter_bank(self.in_rate, self.out_rate)
+        self.half = (self.bank.shape[1] - 1) // 2
+        self.buffer = np.zeros(self.half, dtype=np.float32)  # zero-padding at start
+        self.buffer_start = -self.half  # input-index of buffer[0]
+        self.num_input = 0
+        self.num_output = 0
+        return self
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        self.buffer = np.concatenate([self.buffer, chunk.astype(np.float32)])
+        self.num_input += len(chunk)
+        return self._emit(self.num_input - self.half)
+
+    def flush(self) -> np.ndarray:
+        self.buffer = np.concatenate(
+            [self.buffer, np.zeros(self.half, dtype=np.float32)]
+        )
+        num_total = -(-self.num_input * self.up // self.down)  # ceil
+        return self._emit(self.num_input, num_total)
+
+    def _emit(self, input_end: int, max_output=None) -> np.ndarray:
+        """
+        emits output-samples whose center-input-index q satisfies q < input_end
+        """
+        end = -(-input_end * self.up // self.down)  # first n with n*down/up >= input_end
+        if max_output is not None:
+            end = min(end, max_output)
+        n = np.arange(self.num_output, max(end, self.num_output))
+        q, p = np.divmod(n * self.down, self.up)
+        window_idx = q[:, None] - self.half - self.buffer_start + np.arange(
+            self.bank.shape[1]
+        )
+        out = np.einsum("ij,ij->i", self.bank[p], self.buffer[window_idx])
+        self.num_output += len(n)
+
+        next_q = self.num_output * self.down // self.up
+        consumed = next_q - self.half - self.buffer_start
+        self.buffer = self.buffer[consumed:]
+        self.buffer_start += consumed
+        return out.astype(np.float32)
+
+
+def resample(
+    audio: np.ndarray, in_rate: int, out_rate: int, block_size: int = 2 ** 16
+) -> np.ndarray:
+    """
+    processing in blocks keeps the gathered filter-windows small
+    """
+    resampler = StreamingResampler(in_rate, out_rate).init()
+    blocks = [
+        resampler.process(audio[k : k + block_size])
+        for k in range(0, len(audio), block_size)
+    ]
+    return np.concatenate(blocks + [resampler.flush()])
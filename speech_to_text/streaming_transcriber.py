@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from speech_to_text.asr_segment_glueing import TranscriptGluer
+from speech_to_text.transcribe_audio import (
+    AlignedTranscript,
+    FramePath,
+    GreedyDecoder,
+    LetterArray,
+    TARGET_SAMPLE_RATE,
+)
+
+
+@dataclass
+class StreamingTranscriber:
+    """
+    cuts an audio-stream into overlapping windows and glues their transcripts
+    letters before the start of the next window can not change anymore -> final
+    longer windows/shorter hops are more accurate, shorter windows/longer hops give less latency
+    only the current window of audio and the not yet final letters are kept in memory
+    glue, decoder: see TranscriptGluer
+    """
+
+    window_dur: float = 10.0
+    hop_dur: float = 5.0
+    sample_rate: int = TARGET_SAMPLE_RATE
+    glue: str = "text"
+    decoder: Optional[GreedyDecoder] = None
+
+    def init(self):
+        self.window = round(self.window_dur * self.sample_rate)
+        self.hop = round(self.hop_dur * self.sample_rate)
+        assert 0 < self.hop < self.window, "windows need to overlap for glueing"
+        self.buffer = np.zeros(0, dtype=np.int16)
+        self.buffer_start = 0  # stream-index of buffer[0]
+        self.next_window_start = 0
+        self.transcribed_until = 0
+        self.gluer = TranscriptGluer(glue=self.glue, decoder=self.decoder).init()
+        return self
+
+    @property
+    def stream_len(self):
+        return self.buffer_start + len(self.buffer)
+
+    def push_audio(self, chunk: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        """
+        returns windows (start-index, audio) that are ready to be transcribed
+        """
+        self.buffer = np.concatenate([self.buffer, chunk])
+        windows = []
+        while self.stream_len >= self.next_window_start + self.window:
+            windows.append(self._cut_window(self.next_window_start + self.window))
+        self.buffer = self.buffer[self.next_window_start - self.buffer_start :]
+        self.buffer_start = self.next_window_start
+        return windows
+
+    def flush_audio(self) -> List[Tuple[int, np.ndarray]]:
+        """
+        at end of stream the not yet transcribed rest goes into a shorter last window
+        """
+        if self.stream_len > self.transcribed_until:
+            return [self._cut_window(self.stream_len)]
+        else:
+            return []
+
+    def _cut_window(self, end: int) -> Tuple[int, np.ndarray]:
+        start = self.next_window_start
+        window = start, self.buffer[start - self.buffer_start : end - self.buffer_start]
+        self.next_window_start += self.hop
+        self.transcribed_until = end
+        return window
+
+    def add_transcript(
+        self,
+        start_idx: int,
+        letters: LetterArray,
+        frame_path: Optional[FramePath] = None,
+    ) -> Tuple[str, str]:
+        """
+        windows' transcripts must be added in order
+        returns newly finalized text and interim text (which might still change)
+        """
+        final = self.gluer.push(
+            AlignedTranscript(letters, self.sample_rate, start_idx, frame_path),
+            commit_until=start_idx + self.hop,  # start of next window
+        )
+        return final.text, self.interim_text
+
+    @property
+    def interim_text(self) -> str:
+        return self.gluer.pending.text
+
+    def finish(self) -> str:
+        return self.gluer.finish().text
@@ -0,0 +1,167 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from text_processing.smith_waterman_alignment import smith_waterman_alignment
+
+ANCHOR_NGRAM = 3
+
+
+@dataclass(frozen=True)
+class TokenMatch:
+    """
+    ref-token refi_from equals hyp-token hypi_from
+    """
+
+    refi_from: int
+    hypi_from: int
+
+    @property
+    def refi_to(self):
+        return self.refi_from + 1
+
+    @property
+    def hypi_to(self):
+        return self.hypi_from + 1
+
+
+def unique_ngrams(tokens: Sequence[str], n: int) -> Dict[Tuple[str, ...], int]:
+    """
+    n-grams occurring exactly once, with their position
+    """
+    ngrams = [tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1)]
+    counts = Counter(ngrams)
+    return {g: i for i, g in enumerate(ngrams) if counts[g] == 1}
+
+
+def longest_increasing_chain(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    pairs sorted by first element, returns longest subsequence that also increases in second element
+    patience-sorting in O(k log k)
+    """
+    tails_j: List[int] = []  # smallest last j of chains of length k+1
+    tails_idx: List[int] = []
+    predecessor = [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        length = int(np.searchsorted(tails_j, j, side="left"))
+        predecessor[k] = tails_idx[length - 1] if length > 0 else -1
+        if length == len(tails_j):
+            tails_j.append(j)
+            tails_idx.append(k)
+        else:
+            tails_j[length] = j
+            tails_idx[length] = k
+    chain = []
+    k = tails_idx[-1] if len(tails_idx) > 0 else -1
+    while k >= 0:
+        chain.append(pairs[k])
+        k = predecessor[k]
+    return chain[::-1]
+
+
+def find_anchors(
+    ref: Sequence[str], hyp: Sequence[str], n: int = ANCHOR_NGRAM
+) -> List[Tuple[int, int]]:
+    """
+    token-pairs of n-grams that are unique in ref and in hyp, in an order consistent for both
+    """
+    unique_ref, unique_hyp = unique_ngrams(ref, n), unique_ngrams(hyp, n)
+    pairs = sorted((i, unique_hyp[g]) for g, i in unique_ref.items() if g in unique_hyp)
+    anchors = []
+    for i, j in longest_increasing_chain(pairs):
+        for k in range(n):
+            if len(anchors) == 0 or (
+                i + k > anchors[-1][0] and j + k > anchors[-1][1]
+            ):
+                anchors.append((i + k, j + k))
+    return anchors
+
+
+def select_cuts(
+    anchors: List[Tuple[int, int]], segment_len: int
+) -> List[Tuple[int, int]]:
+    """
+    anchors at least segment_len ref-tokens apart
+    """
+    cuts = []
+    for i, j in anchors:
+        if len(cuts) == 0 or i - cuts[-1][0] >= segment_len:
+            cuts.append((i, j))
+    return cuts
+
+
+_worker_tokens: Optional[Tuple[Sequence[str], Sequence[str], List[Tuple[int, int]]]] = None
+
+
+def _init_worker(ref: Sequence[str], hyp: Sequence[str], bounds: List[Tuple[int, int]]):
+    global _worker_tokens
+    _worker_tokens = ref, hyp, bounds
+
+
+def _align_segment_in_worker(k: int) -> List[TokenMatch]:
+    return align_segment(*_worker_tokens, k)
+
+
+def align_segment(
+    ref: Sequence[str], hyp: Sequence[str], bounds: List[Tuple[int, int]], k: int
+) -> List[TokenMatch]:
+    """
+    matches from ref-token bounds[k] (inclusive) to bounds[k+1] (exclusive)
+    smith_waterman_alignment runs on a window around the segment that is widened (doubling the number of
+    neighbouring bounds) until the alignment runs through the bounds at both window-edges,
+    as the full alignment would, the texts' edges (first and last bound) need not be matched,
+    so in the worst case the window is the whole texts
+    """
+    (i0, _), (i1, _) = bounds[k], bounds[k + 1]
+    width = 1
+    while True:
+        lo, hi = max(0, k - width), min(len(bounds) - 1, k + 1 + width)
+        ref_from, hyp_from = max(bounds[lo][0], 0), max(bounds[lo][1], 0)
+        alignments, _ = smith_waterman_alignment(
+            ref[ref_from : bounds[hi][0] + 1], hyp[hyp_from : bounds[hi][1] + 1]
+        )
+        matches = [
+            (ref_from + al.refi_from, hyp_from + al.hypi_from)
+            for al in alignments
+            if al.ref == al.hyp
+        ]
+        edges = [bounds[b] for b in [lo, hi] if 0 < b < len(bounds) - 1]
+        if all(edge in matches for edge in edges):
+            return [TokenMatch(i, j) for i, j in matches if i0 <= i < i1]
+        width *= 2
+
+
+def align_tokens(
+    ref: Sequence[str],
+    hyp: Sequence[str],
+    anchor_ngram: int = ANCHOR_NGRAM,
+    segment_len: int = 50,
+    num_workers: int = 1,
+) -> List[TokenMatch]:
+    """
+    gives the matches of smith_waterman_alignment over the whole texts, without aligning the whole texts:
+    unique n-grams shared by ref and hyp are anchors, some of them (segment_len tokens apart) cut the texts
+    into segments, which are aligned separately (see align_segment),
+    so costs are quadratic in the size of the segments instead of the whole texts,
+    without anchors it is the full alignment
+    segments are independent and aligned in num_workers processes
+    """
+    anchors = find_anchors(ref, hyp, anchor_ngram)
+    bounds = [(-1, -1)] + select_cuts(anchors, segment_len) + [(len(ref), len(hyp))]
+    segments = list(range(len(bounds) - 1))
+    if num_workers > 1 and len(segments) > 1:
+        with ProcessPoolExecutor(
+            num_workers, initializer=_init_worker, initargs=(ref, hyp, bounds)
+        ) as executor:
+            segment_matches = list(
+                executor.map(
+                    _align_segment_in_worker,
+                    segments,
+                    chunksize=max(1, len(segments) // (4 * num_workers)),
+                )
+            )
+    else:
+        segment_matches = [align_segment(ref, hyp, bounds, k) for k in segments]
+    return [m for ms in segment_matches for m in ms]
@@ -1,16 +1,47 @@
 import itertools
 import os
+import warnings
 from dataclasses import dataclass
-from typing import Optional, List, Tuple
+from functools import cached_property
+from typing import Optional, List, Tuple, Iterator, Iterable
 
-import librosa
 import numpy as np
 import torch
 from nemo.collections.asr.parts.preprocessing import AudioSegment
 from speech_processing.speech_utils import MAX_16_BIT_PCM
-from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC
+from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC, Wav2Vec2Config
+
+from speech_to_text.inference_backends import (
+    BACKENDS,
+    EXPORTED_MODELS_DIR,
+    EagerBackend,
+    OnnxBackend,
+    TorchScriptBackend,
+    exported_model_file,
+    feat_extract_output_lengths,
+)
+from speech_to_text.resampling import resample
 
 TARGET_SAMPLE_RATE = 16_000
+PRECISIONS = ["fp32", "int8", "bf16"]
+
+
+def cpu_supports_bf16() -> bool:
+    if not os.path.isfile("/proc/cpuinfo"):
+        return False
+    with open("/proc/cpuinfo") as f:
+        cpuinfo = f.read()
+    return "avx512_bf16" in cpuinfo or "amx_bf16" in cpuinfo
+
+
+def effective_precision(precision: str) -> str:
+    """
+    bf16 falls back to fp32 on cpus without bf16-support, warned about once per process
+    """
+    if precision == "bf16" and not cpu_supports_bf16():
+        warnings.warn("cpu does not support bf16, falling back to fp32")
+        return "fp32"
+    return precision
 
 
 @dataclass
@@ -19,26 +50,105 @@ class LetterIdx:
     r_idx: int  # relative index
 
 
+@dataclass(eq=False)
+class LetterArray:
+    """
+    columnar sequence of letters: unicode-codepoints and their indizes
+    slicing returns views, indexing and iterating give LetterIdx-objects
+    """
+
+    codepoints: np.ndarray  # uint32
+    r_idx: np.ndarray  # int64
+
+    @classmethod
+    def from_text(cls, text: str, r_idx) -> "LetterArray":
+        codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        r_idx = np.asarray(r_idx, dtype=np.int64)
+        assert len(codepoints) == len(r_idx)
+        return cls(codepoints, r_idx)
+
+    @classmethod
+    def from_letters(cls, letters: Iterable[LetterIdx]) -> "LetterArray":
+        letters = list(letters)
+        return cls.from_text(
+            "".join([l.letter for l in letters]), [l.r_idx for l in letters]
+        )
+
+    @classmethod
+    def concat(cls, letter_arrays: List["LetterArray"]) -> "LetterArray":
+        if len(letter_arrays) == 0:
+            return cls.from_text("", [])
+        return cls(
+            np.concatenate([la.codepoints for la in letter_arrays]),
+            np.concatenate([la.r_idx for la in letter_arrays]),
+        )
+
+    @cached_property
+    def text(self) -> str:
+        return self.codepoints.tobytes().decode("utf-32-le")
+
+    def __len__(self):
+        return len(self.r_idx)
+
+    def __iter__(self) -> Iterator[LetterIdx]:
+        return (LetterIdx(l, i) for l, i in zip(self.text, self.r_idx.tolist()))
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return LetterIdx(chr(self.codepoints[item]), int(self.r_idx[item]))
+        else:
+            return LetterArray(self.codepoints[item], self.r_idx[item])
+
+    def shift(self, offset: int) -> "LetterArray":
+        return LetterArray(self.codepoints, self.r_idx + offset)
+
+    def slice_by_samples(self, start=None, end=None) -> "LetterArray":
+        """
+        letters with start <= r_idx < end, r_idx must be sorted
+        """
+        first = 0 if start is None else np.searchsorted(self.r_idx, start, "left")
+        last = len(self) if end is None else np.searchsorted(self.r_idx, end, "left")
+        return self[first:last]
+
+
+@dataclass
+class FramePath:
+    """
+    frame-level greedy path of a window, frames are mapped to array-indizes as in GreedyDecoder
+    """
+
+    path: np.ndarray  # [T] argmax token per frame
+    input_len: int  # length of window-array the path was calculated from
+
+    def frame_to_sample(self, frames):
+        return np.rint(self.input_len / len(self.path) * frames).astype(np.int64)
+
+
 @dataclass
 class AlignedTranscript:
-    letters: List[LetterIdx]
+    letters: LetterArray  # a list of LetterIdx gets converted
     sample_rate: int
     start_idx: int = 0
+    frame_path: Optional[FramePath] = None  # needed for frame-level glueing
+
+    def __post_init__(self):
+        if not isinstance(self.letters, LetterArray):
+            self.letters = LetterArray.from_letters(self.letters)
 
     @property
     def text(self):
-        return "".join([x.letter for x in self.letters])
+        return self.letters.text
 
     @property
     def array_idx(self):
-        return [x.r_idx for x in self.letters]
+        return self.letters.r_idx
 
     def abs_idx(self, letter: LetterIdx):
         return self.start_idx + letter.r_idx
 
     @property
     def timestamps(self):
-        return [l.r_idx / self.sample_rate for l in self.letters]
+        return self.letters.r_idx / self.sample_rate
 
 
 @dataclass
@@ -59,72 +169,209 @@ class GreedyDecoder:
         else:
             self.silence_idx = tgt_dict.index("</s>")
 
+        self.letters = np.array(
+            [" " if k == self.silence_idx else t for k, t in enumerate(tgt_dict)],
+            dtype=object,
+        )
+        self.letter_lens = np.array([len(l) for l in self.letters])
         return self
 
     @property
     def silence_str(self):
         return self.tgt_dict[self.silence_idx]
 
-    def get_prefix(self, idxs):
-        """Normalize tokens by handling CTC blank, ASG replabels, etc."""
-        idxs = (
-            (next(g)[0], k)
-            for k, g in itertools.groupby(list(enumerate(idxs)), key=lambda x: x[1])
+    def decode_batch(
+        self,
+        greedy_path: np.ndarray,
+        num_frames: Optional[np.ndarray] = None,
+        input_lens: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, np.ndarray]]:
+        """
+        CTC-collapsing of [B, T] greedy-path: repeats and blanks are removed, leading/trailing silence stripped
+        num_frames: number of valid (not padded) frames per item
+        input_lens: if given, frame-indizes are mapped to indizes of input-arrays of these lengths
+        returns per item its letters and their (frame- or array-) indizes,
+        tokens with multiple characters (like <unk>) get one index per character
+        """
+        B, T = greedy_path.shape
+        num_frames = np.full(B, T) if num_frames is None else np.asarray(num_frames)
+        frames = np.arange(T)
+
+        is_new = np.ones((B, T), dtype=bool)
+        is_new[:, 1:] = greedy_path[:, 1:] != greedy_path[:, :-1]
+        is_letter = (
+            is_new & (greedy_path != self.blank) & (frames < num_frames[:, None])
         )
-        seqidx_vocabidx = list(filter(lambda x: x[1] != self.blank, idxs))
-        assert len(seqidx_vocabidx) > 0
-        seqidx_vocabidx = self.strip_startend_silence(seqidx_vocabidx)
-        prefix_answer = "".join([self.tgt_dict[i] for _, i in seqidx_vocabidx])
-        assert not (
-            prefix_answer.startswith(self.silence_str)
-            or prefix_answer.endswith(self.silence_str)
+        is_speech = is_letter & (greedy_path != self.silence_idx)
+        first = np.argmax(is_speech, axis=1)
+        last = T - 1 - np.argmax(is_speech[:, ::-1], axis=1)
+        is_letter &= (
+            (frames >= first[:, None])
+            & (frames <= last[:, None])
+            & is_speech.any(axis=1)[:, None]
         )
-        seqidx = [i for i, _ in seqidx_vocabidx]
-        return {"text": prefix_answer.replace(self.silence_str, " "), "seq_idx": seqidx}
 
-    def strip_startend_silence(self, seqidx_vocabidx: List[Tuple[int, int]]):
-        while seqidx_vocabidx[0][1] == self.silence_idx:
-            seqidx_vocabidx = seqidx_vocabidx[1:]
-        while seqidx_vocabidx[-1][1] == self.silence_idx:
-            seqidx_vocabidx = seqidx_vocabidx[:-1]
-        return seqidx_vocabidx
+        rows, seq_idx = np.nonzero(is_letter)
+        tokens = greedy_path[rows, seq_idx]
+        letters = self.letters[tokens]
+        if input_lens is not None:
+            ratio = np.asarray(input_lens) / num_frames
+            seq_idx = np.rint(ratio[rows] * seq_idx).astype(np.int64)
+        letter_lens = self.letter_lens[tokens]
+        seq_idx = np.repeat(seq_idx, letter_lens)
+        letter_splits = np.cumsum(np.count_nonzero(is_letter, axis=1))[:-1]
+        idx_splits = np.cumsum(np.bincount(rows, letter_lens, minlength=B))[:-1]
+        return [
+            ("".join(l), i)
+            for l, i in zip(
+                np.split(letters, letter_splits),
+                np.split(seq_idx, idx_splits.astype(np.int64)),
+            )
+        ]
 
     def decode(self, emissions):
-        B, T, N = emissions.size()
-        greedy_path = torch.argmax(emissions, dim=-1)
-        return [self.get_prefix(greedy_path[b].tolist()) for b in range(B)]
+        greedy_path = torch.argmax(emissions, dim=-1).numpy()
+        return [
+            {"text": text, "seq_idx": seq_idx.tolist()}
+            for text, seq_idx in self.decode_batch(greedy_path)
+        ]
 
 
 @dataclass
 class SpeechToText:
     model_name: str
     input_sample_rate: Optional[int] = None
+    precision: str = "fp32"  # one of PRECISIONS
+    backend: str = "eager"  # one of BACKENDS, exported ones need to be exported before
+    exported_models_dir: str = EXPORTED_MODELS_DIR
+    num_threads: Optional[int] = None
 
     def init(self):
+        assert self.precision in PRECISIONS, self.precision
+        assert self.backend in BACKENDS, self.backend
+        assert (
+            self.backend == "eager" or self.precision == "fp32"
+        ), "reduced precision only for eager backend"
+        self.precision = effective_precision(self.precision)
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+
         self.processor = Wav2Vec2Processor.from_pretrained(self.model_name)
         assert self.processor.feature_extractor.do_normalize is True
-        self.model = Wav2Vec2ForCTC.from_pretrained(self.model_name)
+        self.config = Wav2Vec2Config.from_pretrained(self.model_name)
+        self.model = None
+        if self.backend == "eager":
+            self.model = Wav2Vec2ForCTC.from_pretrained(self.model_name)
+            if self.precision == "int8":
+                self.model = torch.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            self.engine = EagerBackend(self.model, self.precision == "bf16")
+        else:
+            model_file = exported_model_file(
+                self.model_name, self.backend, self.exported_models_dir
+            )
+            if self.backend == "torchscript":
+                self.engine = TorchScriptBackend(model_file).init()
+            else:
+                self.engine = OnnxBackend(model_file, self.num_threads).init()
         target_dictionary = list(self.processor.tokenizer.get_vocab().keys())
         print(f"target_dictionary: {target_dictionary}")
         self.decoder = GreedyDecoder(target_dictionary).init()
         return self
 
+    @property
+    def meta(self):
+        """
+        to be stored alongside transcripts
+        """
+        return {
+            "model_name": self.model_name,
+            "precision": self.precision,
+            "backend": self.backend,
+        }
+
     def transcribe_audio_array(
         self, audio: np.ndarray, input_sample_rate: Optional[int] = None
-    ) -> List[LetterIdx]:
+    ) -> LetterArray:
 
         logits = self._calc_logits(audio, input_sample_rate)
         return self.decode_with_timestamps(logits, len(audio))
 
-    def decode_with_timestamps(self, logits, input_len):
-        transcript = self.decoder.decode(logits)[0]
-        array_idx = [
-            round(input_len / logits.size()[1] * i) for i in transcript["seq_idx"]
+    def transcribe_audio_arrays(
+        self, audios: List[np.ndarray], input_sample_rate: Optional[int] = None
+    ) -> List[LetterArray]:
+        """
+        one forward-pass for consecutive arrays of same length, gives same result as calling transcribe_audio_array for each
+        """
+        return [
+            letters
+            for letters, _ in self.transcribe_audio_arrays_with_frame_paths(
+                audios, input_sample_rate
+            )
+        ]
+
+    def transcribe_audio_arrays_with_frame_paths(
+        self, audios: List[np.ndarray], input_sample_rate: Optional[int] = None
+    ) -> List[Tuple[LetterArray, FramePath]]:
+        """
+        like transcribe_audio_arrays but additionally returns each array's greedy path
+        """
+        results = [None] * len(audios)
+        for batch, logits, num_frames in self._forward(audios, input_sample_rate):
+            greedy_path = torch.argmax(logits, dim=-1).numpy()
+            num_frames = np.asarray(num_frames)
+            input_lens = [len(audios[k]) for k in batch]
+            batch_letters = self.decode_paths_with_timestamps(
+                greedy_path, input_lens, num_frames
+            )
+            for b, (k, l) in enumerate(zip(batch, batch_letters)):
+                path = greedy_path[b, : num_frames[b]]
+                results[k] = (l, FramePath(path, input_lens[b]))
+        return results
+
+    def decode_with_timestamps(self, logits, input_len) -> LetterArray:
+        return self.decode_batch_with_timestamps(logits, [input_len])[0]
+
+    def decode_batch_with_timestamps(
+        self, logits, input_lens: List[int], num_frames=None
+    ) -> List[LetterArray]:
+        greedy_path = torch.argmax(logits, dim=-1).numpy()
+        return self.decode_paths_with_timestamps(greedy_path, input_lens, num_frames)
+
+    def decode_paths_with_timestamps(
+        self, greedy_path: np.ndarray, input_lens: List[int], num_frames=None
+    ) -> List[LetterArray]:
+        num_frames = None if num_frames is None else np.asarray(num_frames)
+        return [
+            LetterArray.from_text(text, array_idx)
+            for text, array_idx in self.decoder.decode_batch(
+                greedy_path, num_frames, input_lens
+            )
         ]
-        return [LetterIdx(l, i) for l, i in zip(transcript["text"], array_idx)]
 
     def _calc_logits(self, audio: np.ndarray, input_sample_rate: Optional[int] = None):
+        return self._calc_logits_batch([audio], input_sample_rate)[0]
+
+    def _calc_logits_batch(
+        self, audios: List[np.ndarray], input_sample_rate: Optional[int] = None
+    ) -> List[torch.Tensor]:
+        """
+        returns one [1, T, N] logits-tensor per array, padded frames are cut away
+        """
+        logits = [None] * len(audios)
+        for batch, batch_logits, num_frames in self._forward(audios, input_sample_rate):
+            for b, (k, n) in enumerate(zip(batch, num_frames.tolist())):
+                logits[k] = batch_logits[b : b + 1, :n]
+        return logits
 
+    def _forward(
+        self, audios: List[np.ndarray], input_sample_rate: Optional[int] = None
+    ) -> Iterator[Tuple[List[int], torch.Tensor, torch.Tensor]]:
+        """
+        consecutive arrays of same length are batched, yields indizes of arrays in batch,
+        [B, T, N] logits and number of valid frames per array
+        """
         input_sample_rate = (
             input_sample_rate
             if input_sample_rate is not None
@@ -132,28 +379,38 @@ class SpeechToText:
         )
         assert input_sample_rate is not None
 
+        audios = [self._preprocess(audio, input_sample_rate) for audio in audios]
+
+        # padding changes the output of models trained without attention-mask, with mask it is not
+        # guaranteed to be identical either (frames at the array's end see padding) -> same lengths only
+        batches = [
+            list(g)
+            for _, g in itertools.groupby(
+                range(len(audios)), key=lambda k: len(audios[k])
+            )
+        ]
+
+        for batch in batches:
+            inputs = self.processor(
+                [audios[k] for k in batch],
+                sampling_rate=TARGET_SAMPLE_RATE,
+                return_tensors="pt",
+                padding=True,
+                return_attention_mask=True,
+            )
+            logits = self.engine(inputs.input_values, inputs.attention_mask)
+            num_frames = feat_extract_output_lengths(
+                self.config, inputs.attention_mask.sum(-1)
+            )
+            yield batch, logits, num_frames
+
+    def _preprocess(self, audio: np.ndarray, input_sample_rate: int) -> np.ndarray:
         if audio.dtype == np.int16:
             audio = audio.astype(np.float32) / MAX_16_BIT_PCM
 
         if input_sample_rate != TARGET_SAMPLE_RATE:
-            audio = librosa.resample(
-                audio.astype(np.float32),
-                input_sample_rate,
-                TARGET_SAMPLE_RATE,
-                scale=True,
-            )
-
-        inputs = self.processor(
-            audio,
-            sampling_rate=TARGET_SAMPLE_RATE,
-            return_tensors="pt",
-            return_attention_mask=True,
-        )
-        with torch.no_grad():
-            logits = self.model(
-                inputs.input_values, attention_mask=inputs.attention_mask
-            ).logits
-        return logits
+            audio = resample(audio, input_sample_rate, TARGET_SAMPLE_RATE)
+        return audio
 
 
 if __name__ == "__main__":
@@ -1,60 +1,224 @@
+import multiprocessing
 import os
-import shutil
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
 sys.path.append(".")
 
 from pathlib import Path
-from tempfile import NamedTemporaryFile
 
 from util import data_io
 
 from speech_to_text.asr_segment_glueing import transcribe_audio_file
+from speech_to_text.emissions_cache import file_hash
+from speech_to_text.letters_file import LETTERS_SUFFIX, write_letters_file
+from speech_to_text.model_pool import MODEL_POOL
+from speech_to_text.transcribe_audio import SpeechToText, effective_precision
+
+
+def write_atomically(file: str, write_fun: Callable[[str], None]):
+    """
+    readers of file never see half-written content
+    """
+    tmp_file = f"{file}.tmp"
+    write_fun(tmp_file)
+    os.replace(tmp_file, file)
+
+
+def transcribe_to_dir(asr: SpeechToText, file: Path, output_dir: str):
+    transcript = transcribe_audio_file(asr, file)  # decoded by ffmpeg on the fly
+    write_atomically(
+        f"{output_dir}/{file.stem}{LETTERS_SUFFIX}",
+        lambda f: write_letters_file(f, transcript, asr.meta),
+    )
+    write_atomically(
+        f"{output_dir}/{file.stem}.txt",
+        lambda f: data_io.write_lines(f, [transcript.text]),
+    )
+    write_atomically(
+        f"{output_dir}/{file.stem}_meta.json",
+        lambda f: data_io.write_json(f, asr.meta),
+    )
+
+
+MANIFEST_NAME = "manifest.json"
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class ManifestEntry:
+    hash: str
+    size: int
+    mtime: float
+    params: dict
+    status: str = "todo"  # done, failed
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class Manifest:
+    """
+    records per input-file (by name) its content-hash, the parameters it was transcribed with and status,
+    size and mtime are recorded so that unchanged files do not need to be hashed again
+    """
+
+    file: str
+
+    def init(self):
+        self.entries: Dict[str, ManifestEntry] = {}
+        if os.path.isfile(self.file):
+            self.entries = {
+                name: ManifestEntry(**d)
+                for name, d in data_io.read_json(self.file).items()
+            }
+        return self
+
+    def update(self, file: Path, params: dict) -> ManifestEntry:
+        """
+        a changed file or changed parameters make a new entry
+        """
+        stat = file.stat()
+        entry = self.entries.get(file.name)
+        unchanged_stat = (
+            entry is not None
+            and entry.size == stat.st_size
+            and entry.mtime == stat.st_mtime
+        )
+        content_hash = entry.hash if unchanged_stat else file_hash(file)
+        if entry is None or entry.hash != content_hash or entry.params != params:
+            entry = ManifestEntry(content_hash, stat.st_size, stat.st_mtime, params)
+        entry.size, entry.mtime = stat.st_size, stat.st_mtime
+        self.entries[file.name] = entry
+        return entry
+
+    def finished(self, file: Path, error: Optional[str]):
+        entry = self.entries[file.name]
+        entry.attempts += 1
+        entry.status = "done" if error is None else "failed"
+        entry.error = error
+        self.save()
+
+    def save(self):
+        write_atomically(
+            self.file,
+            lambda f: data_io.write_json(
+                f, {name: asdict(e) for name, e in self.entries.items()}
+            ),
+        )
 
-from speech_to_text.transcribe_audio import (
-    SpeechToText,
-    AlignedTranscript,
-)
 
+def files_to_transcribe(
+    manifest: Manifest,
+    files: List[Path],
+    params: dict,
+    output_dir: str,
+    max_attempts: int = MAX_ATTEMPTS,
+) -> List[Path]:
+    todo = []
+    for file in files:
+        entry = manifest.update(file, params)
+        if entry.status == "done" and os.path.isfile(f"{output_dir}/{file.stem}.txt"):
+            continue
+        elif entry.status == "failed" and entry.attempts >= max_attempts:
+            print(f"giving up on {file} after {entry.attempts} attempts")
+        else:
+            todo.append(file)
+    manifest.save()
+    return todo
+
+
+def _transcribe_or_error(
+    asr: SpeechToText, file: Path, output_dir: str
+) -> Tuple[Path, Optional[str]]:
+    try:
+        transcribe_to_dir(asr, file, output_dir)
+        return file, None
+    except Exception:
+        return file, traceback.format_exc()
+
+
+_worker_asr: Optional[SpeechToText] = None
+
+
+def _init_worker(model_name: str, precision: str, num_threads: int):
+    global _worker_asr
+    _worker_asr = SpeechToText(
+        model_name=model_name, precision=precision, num_threads=num_threads
+    ).init()
 
-def convert_to_wav_transcribe(asr, file) -> AlignedTranscript:
-    with NamedTemporaryFile(suffix=".wav", delete=True) as tmp_file:
-        command = (
-            f"ffmpeg -y -i '{file}' -ab 160k -ac 1 -ar 16000 -vn {tmp_file.name}"  #
-        )
-        subprocess.call(command, shell=True)
 
-        transcript = transcribe_audio_file(asr, tmp_file.name)
-    return transcript
+def _transcribe_in_worker(file: Path, output_dir: str) -> Tuple[Path, Optional[str]]:
+    return _transcribe_or_error(_worker_asr, file, output_dir)
+
+
+def transcribe_files(
+    model_name: str,
+    files: List[Path],
+    output_dir: str,
+    precision: str = "fp32",
+    num_workers: int = 1,
+    max_attempts: int = MAX_ATTEMPTS,
+):
+    """
+    resumable: files already transcribed with same content and parameters are skipped,
+    failed ones are retried until they failed max_attempts times, see Manifest
+    with num_workers>1 each worker-process loads the model itself and gets its share of the cpu-cores
+    for its torch-threads, workers are spawned not forked, torch's thread-pools are not fork-safe,
+    a worker that dies raises BrokenProcessPool, rerunning continues with the remaining files
+    """
+    precision = effective_precision(precision)
+    params = SpeechToText(model_name=model_name, precision=precision).meta  # not loaded
+    manifest = Manifest(f"{output_dir}/{MANIFEST_NAME}").init()
+    files = files_to_transcribe(manifest, files, params, output_dir, max_attempts)
+    print(f"{len(files)} files to transcribe")
+    files = sorted(files, key=lambda f: -os.path.getsize(f))  # longest first
+    if num_workers == 1:
+        asr = MODEL_POOL.get(model_name, precision)
+        results = (_transcribe_or_error(asr, file, output_dir) for file in files)
+        for file, error in results:
+            log_result(manifest, file, error)
+        return
+
+    num_threads = max(1, os.cpu_count() // num_workers)
+    with ProcessPoolExecutor(
+        num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_name, precision, num_threads),
+    ) as executor:
+        futures = [
+            executor.submit(_transcribe_in_worker, file, output_dir) for file in files
+        ]
+        for future in as_completed(futures):
+            file, error = future.result()
+            log_result(manifest, file, error)
+
+
+def log_result(manifest: Manifest, file: Path, error: Optional[str]):
+    manifest.finished(file, error)
+    if error is None:
+        print(f"transcribed {file}")
+    else:
+        print(f"failed to transcribe {file}:\n{error}")
 
 
 if __name__ == "__main__":
-
-    import subprocess
-
+    """
+    python speech_to_text/transcribe_directory.py <model> <input_dir> <output_dir> [precision] [num_workers]
+    rerunning continues where the previous run stopped, see transcribe_files
+    """
     model = sys.argv[1]
     input_dir = sys.argv[2]
     output_dir = sys.argv[3]
+    precision = sys.argv[4] if len(sys.argv) > 4 else "fp32"
+    num_workers = int(sys.argv[5]) if len(sys.argv) > 5 else 1
 
-    if os.path.isdir(output_dir):
-        shutil.rmtree(output_dir)
-    os.makedirs(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
 
-    asr = SpeechToText(
-        model_name=model,
-    ).init()
-
-    files = list(Path(input_dir).glob("*.*"))
-    assert len(files)>0
-    for file in files:  # mp4, m4a
-        # transcript = transcribe_audio_file(asr, file)
-        transcript = convert_to_wav_transcribe(asr, file)
-        data_io.write_lines(
-            f"{output_dir}/{file.stem}.csv",
-            [f"{l.letter}\t{l.r_idx}" for l in transcript.letters],
-        )
-
-        data_io.write_lines(
-            f"{output_dir}/{file.stem}.txt",
-            ["".join([l.letter for l in transcript.letters])],
-        )
+    files = list(Path(input_dir).glob("*.*"))  # mp4, m4a
+    assert len(files) > 0
+    transcribe_files(model, files, output_dir, precision, num_workers)
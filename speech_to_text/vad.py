@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+from typing import Iterator, Tuple
+
+import numpy as np
+
+FRAME_DUR = 0.02
+
+
+def frame_features(
+    samples: np.ndarray, frame_len: int, block_frames: int = 10_000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    energy in dB and zero-crossing-rate per frame, computed blockwise to keep memory constant
+    """
+    num_frames = len(samples) // frame_len
+    energy_db = np.empty(num_frames, dtype=np.float32)
+    zcr = np.empty(num_frames, dtype=np.float32)
+    for k in range(0, num_frames, block_frames):
+        n = min(block_frames, num_frames - k)
+        frames = np.asarray(
+            samples[k * frame_len : (k + n) * frame_len], dtype=np.float32
+        ).reshape(n, frame_len)
+        energy_db[k : k + n] = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        sign_changes = np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1])
+        zcr[k : k + n] = np.mean(sign_changes, axis=1)
+    return energy_db, zcr
+
+
+def runs(mask: np.ndarray) -> np.ndarray:
+    """
+    [start, end) frame-indizes of consecutive True-runs
+    """
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+
+@dataclass
+class SpeechSpans:
+    """
+    speech-regions of original audio, concatenated they form the "compact" timeline the model sees
+    pauses: compact indizes of pauses, where windows may be cut
+    """
+
+    starts: np.ndarray
+    ends: np.ndarray
+    pauses: np.ndarray
+
+    def __post_init__(self):
+        lengths = self.ends - self.starts
+        self.compact_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(
+            np.int64
+        )
+        self.num_samples = int(lengths.sum())
+
+    def to_original(self, compact_idx: np.ndarray) -> np.ndarray:
+        span = np.searchsorted(self.compact_starts, compact_idx, side="right") - 1
+        return self.starts[span] + compact_idx - self.compact_starts[span]
+
+    def to_compact(self, original_idx: np.ndarray) -> np.ndarray:
+        """
+        only for indizes that lie within speech-spans
+        """
+        span = np.searchsorted(self.starts, original_idx, side="right") - 1
+        return self.compact_starts[span] + original_idx - self.starts[span]
+
+    def read(self, samples: np.ndarray, start: int, end: int) -> np.ndarray:
+        """
+        compact-timeline range [start, end) gathered from original samples
+        """
+        first = np.searchsorted(self.compact_starts, start, side="right") - 1
+        last = np.searchsorted(self.compact_starts, end, side="left")
+        parts = [
+            samples[
+                self.starts[k] + max(0, start - self.compact_starts[k]) : self.starts[k]
+                + min(end - self.compact_starts[k], self.ends[k] - self.starts[k])
+            ]
+            for k in range(first, last)
+        ]
+        return np.concatenate(parts)
+
+
+def detect_speech(
+    samples: np.ndarray,
+    sample_rate: int,
+    high_db: float = 12.0,
+    low_db: float = 6.0,
+    min_zcr: float = 0.2,
+    min_silence_dur: float = 0.5,
+    padding_dur: float = 0.2,
+    min_speech_fraction: float = 0.01,
+) -> SpeechSpans:
+    """
+    hysteresis on frame-energy relative to noise-floor (10th percentile):
+    speech starts where energy exceeds noise-floor+high_db and lasts as long as it stays above noise-floor+low_db
+    quiet frames with high zero-crossing-rate (fricatives) count as above low_db
+    pauses shorter than min_silence_dur are kept, speech is padded by padding_dur on each side
+    if dynamic range (90th minus 10th percentile) is below high_db (noisy audio or audio without pauses)
+    or less than min_speech_fraction is speech, the relative threshold can not be trusted and all audio is kept
+    """
+    frame_len = round(FRAME_DUR * sample_rate)
+    energy_db, zcr = frame_features(samples, frame_len)
+    no_speech = np.zeros(0, dtype=np.int64)
+    if len(energy_db) == 0:
+        return SpeechSpans(no_speech, no_speech, no_speech)
+
+    noise_floor, loud = np.percentile(energy_db, [10, 90])
+    keep_all = SpeechSpans(
+        np.zeros(1, dtype=np.int64), np.array([len(samples)]), no_speech
+    )
+    if loud - noise_floor < high_db:
+        print(
+            f"WARNING: dynamic range of {loud - noise_floor:.1f} dB is too low for vad, keeping all audio"
+        )
+        return keep_all
+    above_high = energy_db > noise_floor + high_db
+    above_low = (energy_db > noise_floor + low_db) | (
+        (zcr > min_zcr) & (energy_db > noise_floor + low_db / 2)
+    )
+    speech = runs(above_low)
+    if len(speech) > 0:
+        # frames between runs are never above_high, so each sum covers exactly one run
+        speech = speech[np.add.reduceat(above_high.astype(np.int32), speech[:, 0]) > 0]
+    speech_fraction = np.sum(speech[:, 1] - speech[:, 0]) / len(energy_db)
+    if speech_fraction < min_speech_fraction:
+        print(
+            f"WARNING: vad found only {100 * speech_fraction:.1f}% speech, keeping all audio"
+        )
+        return keep_all
+
+    padding = round(padding_dur / FRAME_DUR)
+    speech = np.clip(speech + [-padding, padding], 0, len(energy_db))
+    gaps = speech[1:, 0] - speech[:-1, 1]
+    is_long_pause = gaps >= round(min_silence_dur / FRAME_DUR)
+    span_starts = np.concatenate([speech[:1, 0], speech[1:, 0][is_long_pause]])
+    span_ends = np.concatenate([speech[:-1, 1][is_long_pause], speech[-1:, 1]])
+    starts, ends = span_starts * frame_len, span_ends * frame_len
+    if span_ends[-1] == len(energy_db):  # incomplete last frame
+        ends[-1] = len(samples)
+
+    is_short_pause = ~is_long_pause & (gaps > 0)
+    short_pauses = (speech[1:, 0] + speech[:-1, 1])[is_short_pause] // 2 * frame_len
+    spans = SpeechSpans(starts, ends, no_speech)
+    spans.pauses = np.sort(
+        np.concatenate([spans.compact_starts[1:], spans.to_compact(short_pauses)])
+    )
+    return spans
+
+
+def snap(grid: np.ndarray, pauses: np.ndarray, max_shift: int) -> np.ndarray:
+    """
+    moves grid-points to nearest pause if there is one within max_shift
+    """
+    if len(pauses) == 0:
+        return grid
+    right = np.clip(np.searchsorted(pauses, grid), 0, len(pauses) - 1)
+    left = np.clip(right - 1, 0, len(pauses) - 1)
+    nearest = np.where(
+        np.abs(pauses[left] - grid) <= np.abs(pauses[right] - grid),
+        pauses[left],
+        pauses[right],
+    )
+    return np.where(np.abs(nearest - grid) <= max_shift, nearest, grid)
+
+
+def generate_vad_arrays(
+    samples: np.ndarray, spans: SpeechSpans, step: int
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    like audio_reader.generate_windows but on compact timeline, windows start and end at pauses where possible
+    window k spans [start_k, start_{k+2}), so it overlaps with its neighbours as in generate_windows
+    """
+    grid = np.arange(0, spans.num_samples, step)
+    starts = snap(grid, spans.pauses, step // 4)
+    starts[0] = 0
+    for k, idx in enumerate(starts.tolist()):
+        segm_end_idx = starts[k + 2] if k + 2 < len(starts) else spans.num_samples
+        next_segment_too_small = spans.num_samples - segm_end_idx < step
+        if next_segment_too_small:
+            yield idx, spans.read(samples, idx, spans.num_samples)  # merge this one with next
+            break
+        else:
+            yield idx, spans.read(samples, idx, segm_end_idx)
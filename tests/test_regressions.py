@@ -0,0 +1,188 @@
+"""
+checks that optimized code-paths give same results as the simple ones they replaced
+python -m pytest tests/test_regressions.py
+"""
+import difflib
+from typing import List
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from text_processing.smith_waterman_alignment import smith_waterman_alignment
+
+from speech_to_text.asr_segment_glueing import (
+    glue_left_right,
+    glue_transcripts,
+    transcribe_audio_file,
+)
+from speech_to_text.create_subtitle_files import regex_tokenizer
+from speech_to_text.letters_file import (
+    load_letters,
+    read_letters_csv,
+    read_letters_file,
+    write_letters_file,
+)
+from speech_to_text.model_pool import MODEL_POOL
+from speech_to_text.resampling import StreamingResampler, resample
+from speech_to_text.token_alignment import align_tokens
+from speech_to_text.transcribe_audio import (
+    AlignedTranscript,
+    LetterArray,
+    LetterIdx,
+    SpeechToText,
+    TARGET_SAMPLE_RATE,
+)
+
+WAV_FILE = "tests/resources/LibriSpeech_dev-other_116_288046_116-288046-0011.wav"
+REF_FILE = "tests/resources/ref.txt"
+MODEL = "facebook/wav2vec2-base-960h"
+MODEL_WITH_ATTENTION_MASK = "facebook/wav2vec2-large-960h-lv60-self"
+
+
+@pytest.fixture(scope="module")
+def asr() -> SpeechToText:
+    return MODEL_POOL.get(MODEL)
+
+
+def window_transcripts(step: int, seed: int) -> List[AlignedTranscript]:
+    """
+    letters of reference-text spread over duration of wav-file, each window sees the letters within it,
+    some dropped or misrecognized, without spaces at its edges as decoded ones
+    """
+    rng = np.random.default_rng(seed)
+    text = open(REF_FILE).read().strip()
+    _, samples = wavfile.read(WAV_FILE)
+    letter_idx = np.sort(rng.choice(len(samples), len(text), replace=False))
+    windows = []
+    for start in range(0, len(samples), step):
+        end = start + 2 * step
+        if len(samples) - end < step:
+            end = len(samples)
+        letters = [
+            (c if rng.random() > 0.03 else "x", int(i) - start)
+            for c, i in zip(text, letter_idx)
+            if start <= i < end and rng.random() > 0.03
+        ]
+        while len(letters) > 0 and letters[0][0] == " ":
+            letters.pop(0)
+        while len(letters) > 0 and letters[-1][0] == " ":
+            letters.pop()
+        windows.append(
+            AlignedTranscript(
+                [LetterIdx(c, i) for c, i in letters], TARGET_SAMPLE_RATE, start
+            )
+        )
+        if end == len(samples):
+            break
+    return windows
+
+
+def glue_all_at_once(windows: List[AlignedTranscript]) -> AlignedTranscript:
+    """
+    glue_transcripts as it was before TranscriptGluer, on lists of letters
+    """
+    sm = difflib.SequenceMatcher()
+    letters: List[LetterIdx] = []
+    previous = None
+    for ts in windows:
+        if previous is not None:
+            glued = glue_left_right(left=previous, right=ts, sm=sm)
+            letters = [l for l in letters if l.r_idx < ts.start_idx]
+            letters.extend(LetterIdx(l.letter, glued.abs_idx(l)) for l in glued.letters)
+        else:
+            letters = [LetterIdx(l.letter, ts.abs_idx(l)) for l in ts.letters]
+        previous = ts
+    return AlignedTranscript(letters, TARGET_SAMPLE_RATE)
+
+
+def test_transcript_gluer_equals_gluing_all_at_once():
+    for step_dur in [1, 2, 5]:
+        for seed in range(5):
+            windows = window_transcripts(round(step_dur * TARGET_SAMPLE_RATE), seed)
+            expected = glue_all_at_once(windows)
+            glued = glue_transcripts(iter(windows), debug=False)
+            assert glued.text == expected.text
+            np.testing.assert_array_equal(glued.array_idx, expected.array_idx)
+
+
+def test_streaming_resampler_equals_resampling_at_once():
+    sample_rate, samples = wavfile.read(WAV_FILE)
+    audio = samples.astype(np.float32) / 2 ** 15
+    rng = np.random.default_rng(0)
+    for out_rate in [8_000, 22_050, 44_100]:
+        at_once = resample(audio, sample_rate, out_rate, block_size=len(audio))
+        resampler = StreamingResampler(sample_rate, out_rate).init()
+        bounds = np.sort(rng.choice(len(audio), 50, replace=False))
+        chunks = np.split(audio, bounds)  # some of very different sizes, the first might be empty
+        streamed = np.concatenate(
+            [resampler.process(c) for c in chunks] + [resampler.flush()]
+        )
+        assert len(streamed) == len(at_once) == -(-len(audio) * out_rate // sample_rate)
+        np.testing.assert_allclose(streamed, at_once, rtol=0, atol=1e-6)
+
+
+def test_letters_file_equals_csv(tmp_path):
+    """
+    letters-file read back (memory-mapped) holds same letters as the csv-file it replaced
+    """
+    windows = window_transcripts(TARGET_SAMPLE_RATE, 0)
+    glued = glue_transcripts(iter(windows), debug=False)
+    text = glued.text.replace("x", "ä")  # some non-ascii letters
+    transcripts = {
+        "glued": LetterArray.from_text(text, glued.array_idx),
+        "empty": LetterArray.from_text("", []),
+    }
+    for name, letters in transcripts.items():
+        transcript = AlignedTranscript(letters, TARGET_SAMPLE_RATE)
+        csv_file = tmp_path / f"{name}.csv"
+        with open(csv_file, "w") as f:
+            f.writelines(f"{l.letter}\t{l.r_idx}\n" for l in transcript.letters)
+        from_csv = read_letters_csv(csv_file)
+
+        letters_file = tmp_path / f"{name}_written.letters"
+        write_letters_file(letters_file, transcript, {"model": "some-model"})
+        from_file, meta = read_letters_file(letters_file)
+        converted = load_letters(tmp_path / f"{name}.letters")
+
+        assert meta == {"model": "some-model"}
+        for t in [from_csv, from_file, converted]:
+            assert t.text == transcript.text
+            np.testing.assert_array_equal(t.array_idx, transcript.array_idx)
+
+
+def assert_align_tokens_equals_full_alignment(raw_text: str, corrected_text: str):
+    ref = [t.lower() for _, _, t in regex_tokenizer(raw_text)]
+    hyp = [t.lower() for _, _, t in regex_tokenizer(corrected_text)]
+    alignments, _ = smith_waterman_alignment(ref, hyp)
+    expected = [(al.refi_from, al.hypi_from) for al in alignments if al.ref == al.hyp]
+    for segment_len in [1, 5, 20, 50]:
+        matches = align_tokens(ref, hyp, segment_len=segment_len)
+        assert [(m.refi_from, m.hypi_from) for m in matches] == expected
+
+
+def test_align_tokens_equals_full_alignment():
+    text = open(REF_FILE).read().strip()
+    for seed in range(5):
+        windows = window_transcripts(TARGET_SAMPLE_RATE, seed)
+        glued = glue_transcripts(iter(windows), debug=False)
+        assert_align_tokens_equals_full_alignment(glued.text, text)
+
+
+def test_align_tokens_equals_full_alignment_of_transcript(asr):
+    text = open(REF_FILE).read().strip()
+    for step_dur in [1, 2, 5]:
+        transcript = transcribe_audio_file(asr, WAV_FILE, step_dur=step_dur)
+        assert_align_tokens_equals_full_alignment(transcript.text, text)
+
+
+@pytest.mark.parametrize("model_name", [MODEL, MODEL_WITH_ATTENTION_MASK])
+def test_batched_transcription_equals_per_window(model_name):
+    asr = MODEL_POOL.get(model_name)
+    _, samples = wavfile.read(WAV_FILE)
+    for step_dur in [1, 2, 5]:
+        step = round(step_dur * TARGET_SAMPLE_RATE)
+        assert len(samples) % step != 0  # last window differs in length from the others
+        per_window = transcribe_audio_file(asr, WAV_FILE, step_dur, batch_size=1)
+        batched = transcribe_audio_file(asr, WAV_FILE, step_dur, batch_size=8)
+        assert batched.text == per_window.text
+        np.testing.assert_array_equal(batched.array_idx, per_window.array_idx)